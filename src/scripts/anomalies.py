@@ -0,0 +1,190 @@
+"""
+Percent anomalies of the simulation data relative to a baseline.
+
+Baselines and anomalies are cached in process, so each snapshot is read
+and each anomaly computed at most once while it stays in the cache.
+"""
+
+from typing import Tuple, Hashable
+from collections import OrderedDict
+import numpy as np
+
+import read
+import instrument
+
+# The initial state of the planet-only run, as (index, shadow, planet)
+BASELINE = (0, 'none', True)
+# Upper bound on the memory held by the cache, in bytes
+CACHE_NBYTES = 256 * 1024**2
+
+_cache:'OrderedDict[Hashable,np.ndarray]' = OrderedDict()
+_cache_nbytes = 0
+
+def configure_cache(nbytes:int):
+    """
+    Set the size of the cache, evicting entries if it is now too full.
+
+    Parameters
+    ----------
+    nbytes : int
+        The maximum number of bytes to keep in the cache
+    """
+    global CACHE_NBYTES
+    CACHE_NBYTES = nbytes
+    _evict()
+
+def clear_cache():
+    """
+    Empty the cache.
+    """
+    global _cache_nbytes
+    _cache.clear()
+    _cache_nbytes = 0
+
+def _evict():
+    """
+    Drop the least recently used entries until the cache fits.
+    """
+    global _cache_nbytes
+    while _cache and _cache_nbytes > CACHE_NBYTES:
+        _, value = _cache.popitem(last=False)
+        _cache_nbytes -= value.nbytes
+
+def _lookup(key:Hashable)->'np.ndarray | None':
+    value = _cache.get(key)
+    if value is not None:
+        _cache.move_to_end(key)
+    return value
+
+def _remember(key:Hashable, value:np.ndarray)->np.ndarray:
+    """
+    Cache a value, marking it read-only since it will be shared.
+    """
+    global _cache_nbytes
+    value.flags.writeable = False
+    _cache[key] = value
+    _cache_nbytes += value.nbytes
+    _evict()
+    return value
+
+@instrument.timed
+def get_baseline(var_name:str='rho', baseline:Tuple[int,str,bool]=BASELINE)->np.ndarray:
+    """
+    Get the baseline data, reading it only once.
+
+    Parameters
+    ----------
+    var_name : str
+        The name of the variable
+    baseline : tuple
+        The (index, shadow, planet) of the baseline snapshot
+
+    Returns
+    -------
+    np.ndarray
+        The read-only baseline data (nphi, nrad)
+    """
+    key = ('baseline', var_name, baseline)
+    value = _lookup(key)
+    if value is None:
+        value = _remember(key, np.asarray(read.get_data(*baseline, var_name)))
+    return value
+
+def _percent_difference(a:np.ndarray, b:np.ndarray, base:np.ndarray, out:np.ndarray=None)->np.ndarray:
+    """
+    Compute ``(a - b) / base * 100`` in place in a single buffer.
+    """
+    out = np.subtract(a, b, out=out)
+    np.divide(out, base, out=out)
+    np.multiply(out, 100, out=out)
+    return out
+
+@instrument.timed
+def anomaly(
+    index:int,
+    shadow:str,
+    planet:bool,
+    var_name:str='rho',
+    baseline:Tuple[int,str,bool]=BASELINE,
+    out:np.ndarray=None
+)->np.ndarray:
+    """
+    Get the percent anomaly of a snapshot relative to the baseline.
+
+    Parameters
+    ----------
+    index : int
+        The index of the snapshot
+    shadow : str
+        'none', 'narrow', or 'wide'
+    planet : bool
+        True if the planet is present
+    var_name : str
+        The name of the variable
+    baseline : tuple
+        The (index, shadow, planet) of the baseline snapshot
+    out : np.ndarray, optional
+        A buffer to write the result into. If given, the result is
+        written there and not cached.
+
+    Returns
+    -------
+    np.ndarray
+        The anomaly (nphi, nrad) in percent. Cached results are read-only.
+    """
+    key = ('anomaly', index, read.get_case_name(shadow, planet), var_name, baseline)
+    value = _lookup(key)
+    if value is not None:
+        if out is None:
+            return value
+        np.copyto(out, value)
+        return out
+    base = get_baseline(var_name, baseline)
+    data = read.get_data(index, shadow, planet, var_name)
+    if out is not None:
+        return _percent_difference(data, base, base, out=out)
+    return _remember(key, _percent_difference(data, base, base))
+
+@instrument.timed
+def residual(
+    index:int,
+    shadow:str,
+    var_name:str='rho',
+    baseline:Tuple[int,str,bool]=BASELINE,
+    out:np.ndarray=None
+)->np.ndarray:
+    """
+    Get the percent difference between the runs with and without the
+    planet, relative to the baseline.
+
+    Parameters
+    ----------
+    index : int
+        The index of the snapshot
+    shadow : str
+        'narrow' or 'wide'
+    var_name : str
+        The name of the variable
+    baseline : tuple
+        The (index, shadow, planet) of the baseline snapshot
+    out : np.ndarray, optional
+        A buffer to write the result into. If given, the result is
+        written there and not cached.
+
+    Returns
+    -------
+    np.ndarray
+        The residual (nphi, nrad) in percent. Cached results are read-only.
+    """
+    key = ('residual', index, shadow, var_name, baseline)
+    value = _lookup(key)
+    if value is not None:
+        if out is None:
+            return value
+        np.copyto(out, value)
+        return out
+    base = get_baseline(var_name, baseline)
+    fields = [read.get_data(index, shadow, planet, var_name) for planet in (True, False)]
+    if out is not None:
+        return _percent_difference(*fields, base, out=out)
+    return _remember(key, _percent_difference(*fields, base))
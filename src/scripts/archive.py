@@ -0,0 +1,484 @@
+"""
+Random access to the members of the gzipped data archives.
+
+An index of member offsets and access points is built once per archive
+and saved next to it. Members are then decompressed on demand, starting
+from the nearest access point instead of the beginning of the archive.
+
+An access point is a deflate block boundary that falls on a byte, saved
+with the 32 KiB of output before it, so any process can resume there
+with a raw ``zlib`` decompressor. Finding block boundaries needs zlib's
+``Z_BLOCK`` mode, which the ``zlib`` module does not expose, so the index
+is built through the zlib shared library with ``ctypes``. Without it the
+index has no saved access points and ``seekable`` is False.
+"""
+
+import os
+import io
+import json
+import zlib
+import bisect
+import ctypes
+import ctypes.util
+import tarfile
+import functools
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+# Uncompressed bytes between access points
+SPAN = 4 * 1024**2
+# Compressed bytes read at a time
+CHUNK = 256 * 1024
+# gzip header and trailer, as understood by zlib
+WBITS = 16 + zlib.MAX_WBITS
+# The history a deflate stream can refer back to
+WINDOW = 32 * 1024
+# The length of the gzip trailer after each deflate stream
+TRAILER = 8
+GZIP_MAGIC = b'\x1f\x8b'
+# Marks a saved index, and the version of its layout
+INDEX_MAGIC = b'ARCHIDX2'
+
+_indices:Dict[Path,'ArchiveIndex'] = {}
+
+class _AccessPoint:
+    """
+    The decompressor state after consuming ``compressed`` bytes of the
+    archive and producing ``uncompressed`` bytes of the tar stream.
+
+    Saved points have no decompressor, only a way to load their window,
+    and resume as raw deflate streams.
+    """
+    def __init__(self, uncompressed:int, compressed:int, decompressor=None, raw:bool=False, window:Callable[[],bytes]=None):
+        self.uncompressed = uncompressed
+        self.compressed = compressed
+        self.raw = raw
+        self._decompressor = decompressor
+        self._window = window
+
+    def get_decompressor(self):
+        """
+        Get a new decompressor in the state of this point.
+        """
+        if self._decompressor is None:
+            self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=self._window())
+        return self._decompressor.copy()
+
+class _Inflater(io.RawIOBase):
+    """
+    A sequential reader of the decompressed stream, starting from an
+    access point and recording new access points as it goes.
+    """
+    def __init__(self, index:'ArchiveIndex', point:_AccessPoint):
+        self._index = index
+        self._file = open(index.path, 'rb')
+        self._file.seek(point.compressed)
+        self._compressed = point.compressed
+        self._uncompressed = point.uncompressed
+        self._decompressor = point.get_decompressor()
+        self._raw = point.raw
+        self._buffer = bytearray()
+        self._padding = False
+
+    def readable(self)->bool:
+        return True
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+    def _fill(self)->bool:
+        """
+        Decompress the next chunk into the buffer.
+        """
+        chunk = self._file.read(CHUNK) if not self._padding else b''
+        if not chunk:
+            return False
+        self._compressed += len(chunk)
+        out = self._decompressor.decompress(chunk)
+        # concatenated gzip members are valid, so start over after each
+        while self._decompressor.eof and len(self._decompressor.unused_data) > (TRAILER if self._raw else 0):
+            rest = self._decompressor.unused_data
+            if self._raw:
+                # a raw stream leaves the gzip trailer unread
+                rest = rest[TRAILER:]
+                self._raw = False
+            if not GZIP_MAGIC.startswith(rest[:2]):
+                # ignore trailing padding, as gzip does
+                self._padding = True
+                break
+            self._decompressor = zlib.decompressobj(WBITS)
+            out += self._decompressor.decompress(rest)
+        self._uncompressed += len(out)
+        self._buffer += out
+        self._index._record(self._uncompressed, self._compressed, self._decompressor, self._raw)
+        return True
+
+    def skip(self, n:int):
+        """
+        Discard the next ``n`` decompressed bytes.
+        """
+        while n > len(self._buffer):
+            n -= len(self._buffer)
+            self._buffer.clear()
+            if not self._fill():
+                return
+        del self._buffer[:n]
+
+    def read(self, n:int=-1)->bytes:
+        parts = []
+        while n != 0:
+            if not self._buffer and not self._fill():
+                break
+            take = len(self._buffer) if n < 0 else min(n, len(self._buffer))
+            parts.append(bytes(self._buffer[:take]))
+            del self._buffer[:take]
+            if n > 0:
+                n -= take
+        return b''.join(parts)
+
+class _ZStream(ctypes.Structure):
+    """
+    zlib's ``z_stream``.
+    """
+    _fields_ = [
+        ('next_in', ctypes.c_void_p),
+        ('avail_in', ctypes.c_uint),
+        ('total_in', ctypes.c_ulong),
+        ('next_out', ctypes.c_void_p),
+        ('avail_out', ctypes.c_uint),
+        ('total_out', ctypes.c_ulong),
+        ('msg', ctypes.c_char_p),
+        ('state', ctypes.c_void_p),
+        ('zalloc', ctypes.c_void_p),
+        ('zfree', ctypes.c_void_p),
+        ('opaque', ctypes.c_void_p),
+        ('data_type', ctypes.c_int),
+        ('adler', ctypes.c_ulong),
+        ('reserved', ctypes.c_ulong)
+    ]
+
+Z_OK = 0
+Z_STREAM_END = 1
+Z_BLOCK = 5
+# Bits of ``data_type`` after an inflate call with Z_BLOCK
+END_OF_BLOCK = 128
+LAST_BLOCK = 64
+UNUSED_BITS = 7
+
+@functools.lru_cache(maxsize=None)
+def _load_zlib()->'ctypes.CDLL | None':
+    """
+    Load the zlib shared library, or None if it cannot be found.
+    """
+    name = ctypes.util.find_library('z') or ctypes.util.find_library('zlib1')
+    if name is None:
+        return None
+    try:
+        lib = ctypes.CDLL(name)
+    except OSError:
+        return None
+    lib.zlibVersion.restype = ctypes.c_char_p
+    lib.inflateInit2_.argtypes = [ctypes.POINTER(_ZStream), ctypes.c_int, ctypes.c_char_p, ctypes.c_int]
+    for func in (lib.inflate, lib.inflateReset, lib.inflateEnd):
+        func.restype = ctypes.c_int
+    lib.inflate.argtypes = [ctypes.POINTER(_ZStream), ctypes.c_int]
+    lib.inflateReset.argtypes = [ctypes.POINTER(_ZStream)]
+    lib.inflateEnd.argtypes = [ctypes.POINTER(_ZStream)]
+    return lib
+
+class _BlockInflater(io.RawIOBase):
+    """
+    A sequential reader of the whole decompressed stream that stops at
+    every deflate block and saves an access point at the byte-aligned
+    boundaries about ``SPAN`` apart.
+    """
+    def __init__(self, index:'ArchiveIndex', lib:ctypes.CDLL):
+        self._index = index
+        self._lib = lib
+        self._file = open(index.path, 'rb')
+        self._stream = _ZStream()
+        ret = lib.inflateInit2_(ctypes.byref(self._stream), WBITS, lib.zlibVersion(), ctypes.sizeof(_ZStream))
+        if ret != Z_OK:
+            raise zlib.error(f'inflateInit2 failed with {ret}')
+        self._input = ctypes.create_string_buffer(CHUNK)
+        self._output = ctypes.create_string_buffer(CHUNK)
+        self._compressed = 0
+        self._uncompressed = 0
+        self._window = b''
+        self._buffer = bytearray()
+        self._ended = False
+
+    def readable(self)->bool:
+        return True
+
+    def close(self):
+        if not self.closed:
+            self._lib.inflateEnd(ctypes.byref(self._stream))
+            self._file.close()
+        super().close()
+
+    def _fill(self)->bool:
+        """
+        Decompress the next chunk of input into the buffer.
+        """
+        stream = self._stream
+        if stream.avail_in == 0:
+            n = self._file.readinto(self._input)
+            if not n:
+                if not self._ended:
+                    raise EOFError(f'{self._index.path} ended inside a gzip member')
+                return False
+            stream.next_in = ctypes.addressof(self._input)
+            stream.avail_in = n
+        while stream.avail_in:
+            if self._ended:
+                if not GZIP_MAGIC.startswith(ctypes.string_at(stream.next_in, min(stream.avail_in, 2))):
+                    # ignore trailing padding, as gzip does
+                    stream.avail_in = 0
+                    self._file.seek(0, os.SEEK_END)
+                    break
+                # concatenated gzip members are valid, so start over after each
+                self._lib.inflateReset(ctypes.byref(stream))
+                self._ended = False
+            stream.next_out = ctypes.addressof(self._output)
+            stream.avail_out = CHUNK
+            avail_in = stream.avail_in
+            ret = self._lib.inflate(ctypes.byref(stream), Z_BLOCK)
+            if ret not in (Z_OK, Z_STREAM_END):
+                raise zlib.error(f'inflate failed on {self._index.path} with {ret}')
+            out = self._output.raw[:CHUNK - stream.avail_out]
+            self._compressed += avail_in - stream.avail_in
+            self._uncompressed += len(out)
+            self._buffer += out
+            self._window = (self._window + out)[-WINDOW:]
+            if ret == Z_STREAM_END:
+                self._ended = True
+                continue
+            boundary = stream.data_type & END_OF_BLOCK and not stream.data_type & LAST_BLOCK
+            if boundary and stream.data_type & UNUSED_BITS == 0:
+                self._index._save_point(self._uncompressed, self._compressed, self._window)
+        return True
+
+    def read(self, n:int=-1)->bytes:
+        parts = []
+        while n != 0:
+            if not self._buffer and not self._fill():
+                break
+            take = len(self._buffer) if n < 0 else min(n, len(self._buffer))
+            parts.append(bytes(self._buffer[:take]))
+            del self._buffer[:take]
+            if n > 0:
+                n -= take
+        return b''.join(parts)
+
+class ArchiveIndex:
+    """
+    The member offsets and access points of a ``.tar.gz`` archive.
+
+    Parameters
+    ----------
+    path : Path
+        The path to the archive
+    members : dict
+        The (offset, size) of each member in the uncompressed tar
+        stream, keyed by the member's file name
+    seekable : bool, optional
+        True if access points were saved throughout the archive
+    """
+    def __init__(self, path:Path, members:Dict[str,Tuple[int,int]], seekable:bool=False):
+        self.path = Path(path)
+        self.members = members
+        self.seekable = seekable
+        self._points:List[_AccessPoint] = [_AccessPoint(0, 0, zlib.decompressobj(WBITS))]
+        # (uncompressed, compressed, window) of the points to save
+        self._saved:List[Tuple[int,int,bytes]] = []
+
+    def _insert(self, point:_AccessPoint):
+        keys = [p.uncompressed for p in self._points]
+        i = bisect.bisect_left(keys, point.uncompressed)
+        if i == len(keys) or keys[i] != point.uncompressed:
+            self._points.insert(i, point)
+
+    def _record(self, uncompressed:int, compressed:int, decompressor, raw:bool):
+        """
+        Keep an access point in memory if none is within ``SPAN`` before it.
+        """
+        keys = [p.uncompressed for p in self._points]
+        previous = self._points[bisect.bisect_right(keys, uncompressed) - 1]
+        if uncompressed - previous.uncompressed >= SPAN:
+            self._insert(_AccessPoint(uncompressed, compressed, decompressor.copy(), raw))
+
+    def _save_point(self, uncompressed:int, compressed:int, window:bytes):
+        """
+        Keep a resumable access point if it is far enough past the last one.
+        """
+        last = self._saved[-1][0] if self._saved else 0
+        if uncompressed - last >= SPAN:
+            self._saved.append((uncompressed, compressed, window))
+            self._insert(_AccessPoint(uncompressed, compressed, raw=True, window=lambda: window))
+
+    def _seek(self, offset:int)->_Inflater:
+        """
+        Start decompressing at the last access point before ``offset``.
+        """
+        keys = [p.uncompressed for p in self._points]
+        point = self._points[bisect.bisect_right(keys, offset) - 1]
+        inflater = _Inflater(self, point)
+        inflater.skip(offset - point.uncompressed)
+        return inflater
+
+    def read_member(self, name:str)->bytes:
+        """
+        Decompress a single member into memory.
+
+        Parameters
+        ----------
+        name : str
+            The file name of the member
+
+        Returns
+        -------
+        bytes
+            The contents of the member
+        """
+        try:
+            offset, size = self.members[name]
+        except KeyError:
+            raise FileNotFoundError(f'{name} not found in {self.path}') from None
+        with self._seek(offset) as inflater:
+            data = inflater.read(size)
+        if len(data) != size:
+            raise EOFError(f'{self.path} ended inside {name}')
+        return data
+
+    @staticmethod
+    def get_index_path(path:Path)->Path:
+        """
+        Get the path of the saved index for an archive.
+        """
+        return path.with_name(f'{path.name}.index')
+
+    @classmethod
+    def build(cls, path:Path)->'ArchiveIndex':
+        """
+        Scan an archive once, recording the offset of every member and
+        the access points along the way.
+        """
+        lib = _load_zlib()
+        index = cls(path, {}, seekable=lib is not None)
+        if lib is None:
+            inflater = _Inflater(index, index._points[0])
+        else:
+            inflater = _BlockInflater(index, lib)
+        with inflater:
+            with tarfile.open(fileobj=inflater, mode='r|') as tar:
+                for member in tar:
+                    if member.isfile():
+                        index.members[Path(member.name).name] = (member.offset_data, member.size)
+        index.save()
+        return index
+
+    def save(self):
+        """
+        Save the member offsets and access points next to the archive.
+
+        The file holds a JSON header followed by the compressed window
+        of each access point.
+        """
+        stat = self.path.stat()
+        windows = [zlib.compress(window) for _, _, window in self._saved]
+        offsets = [0]
+        for window in windows:
+            offsets.append(offsets[-1] + len(window))
+        header = {
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'seekable': self.seekable,
+            'members': self.members,
+            'points': [
+                [uncompressed, compressed, offset, len(window)]
+                for (uncompressed, compressed, _), offset, window in zip(self._saved, offsets, windows)
+            ]
+        }
+        encoded = json.dumps(header).encode()
+        index_path = self.get_index_path(self.path)
+        tmp_path = index_path.with_name(f'{index_path.name}.{os.getpid()}.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(INDEX_MAGIC)
+            f.write(len(encoded).to_bytes(8, 'little'))
+            f.write(encoded)
+            for window in windows:
+                f.write(window)
+        os.replace(tmp_path, index_path)
+
+    @staticmethod
+    def _read_window(index_path:Path, offset:int, length:int)->bytes:
+        with open(index_path, 'rb') as f:
+            f.seek(offset)
+            return zlib.decompress(f.read(length))
+
+    @classmethod
+    def load(cls, path:Path)->'ArchiveIndex':
+        """
+        Load the saved index of an archive, building it if it is
+        missing or out of date.
+        """
+        path = Path(path)
+        stat = path.stat()
+        index_path = cls.get_index_path(path)
+        try:
+            with open(index_path, 'rb') as f:
+                if f.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+                    raise ValueError('Not an archive index')
+                length = int.from_bytes(f.read(8), 'little')
+                header = json.loads(f.read(length))
+        except (FileNotFoundError, ValueError):
+            header = None
+        if header is None or (header['size'], header['mtime_ns']) != (stat.st_size, stat.st_mtime_ns):
+            print(f'Indexing {path}...')
+            return cls.build(path)
+        members = {name: tuple(value) for name, value in header['members'].items()}
+        index = cls(path, members, header['seekable'])
+        start = len(INDEX_MAGIC) + 8 + length
+        for uncompressed, compressed, offset, size in header['points']:
+            window = functools.partial(cls._read_window, index_path, start + offset, size)
+            index._insert(_AccessPoint(uncompressed, compressed, raw=True, window=window))
+        return index
+
+def get_index(path:Path)->ArchiveIndex:
+    """
+    Get the index of an archive, loading it once per process.
+
+    Parameters
+    ----------
+    path : Path
+        The path to the archive
+
+    Returns
+    -------
+    ArchiveIndex
+        The index of the archive
+    """
+    path = Path(path)
+    if path not in _indices:
+        _indices[path] = ArchiveIndex.load(path)
+    return _indices[path]
+
+def read_member(path:Path, name:str)->bytes:
+    """
+    Read one member of an archive into memory, without extracting it.
+
+    Parameters
+    ----------
+    path : Path
+        The path to the archive
+    name : str
+        The file name of the member
+
+    Returns
+    -------
+    bytes
+        The contents of the member
+    """
+    return get_index(path).read_member(name)
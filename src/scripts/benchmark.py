@@ -0,0 +1,218 @@
+"""
+Benchmarks of the I/O, tracking and analytic-model hot paths.
+
+Everything runs on snapshots written to a temporary directory, so no
+network access or real data is needed. Results are saved as JSON, and
+two result files can be compared with ``--compare``.
+"""
+
+import json
+import time
+import platform
+import tempfile
+import statistics
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+import numpy as np
+import scipy
+import h5py
+
+import paths
+import read
+import spirals
+import tables
+from plot_sound_speed import get_sound_speed
+
+# The (nrad, nphi) grids to benchmark
+SIZES = [(128, 256), (256, 512), (512, 1024)]
+# The number of snapshots read per timing of get_data
+NSNAP = 8
+# The number of timed calls, of which the median is reported
+REPEAT = 5
+OUTFILE = paths.output / 'benchmarks.json'
+
+def _write_snapshots(directory:Path, nrad:int, nphi:int, nsnap:int):
+    """
+    Write a small planet-only case with a logarithmic spiral in the density.
+    """
+    r = np.geomspace(0.4, 2.5, nrad + 1)
+    phi = np.linspace(-np.pi, np.pi, nphi + 1)
+    r_mid = 0.5*(r[1:] + r[:-1])
+    phi_mid = 0.5*(phi[1:] + phi[:-1])
+    case = read.get_case_name('none', True)
+    case_path = directory / case
+    case_path.mkdir()
+    (case_path / read.EXTRACTED_MARKER).touch()
+    prim = np.ones((5, 1, 1, nphi, nrad), dtype=np.float32)
+    for index in range(nsnap):
+        spiral = np.log(r_mid) / np.tan(0.2) + index
+        prim[0, 0, 0] = 1 + 0.1*np.cos(phi_mid[:, None] + spiral[None, :])
+        with h5py.File(case_path / read.get_filename(index, 'none', True), 'w') as f:
+            f['prim'] = prim
+            f['x1f'] = r[None, :].astype(np.float32)
+            f['x2f'] = phi[None, :].astype(np.float32)
+
+def measure(func:Callable, repeat:int=REPEAT, setup:Callable=None)->Tuple[float,int]:
+    """
+    Time a function and find the peak memory it allocates.
+
+    Parameters
+    ----------
+    func : callable
+        The function to benchmark
+    repeat : int, optional
+        The number of timed calls
+    setup : callable, optional
+        Called before every call, outside the timing
+
+    Returns
+    -------
+    seconds : float
+        The median time of a call
+    peak : int
+        The peak memory allocated during a call, in bytes
+    """
+    setup = setup or (lambda: None)
+    setup()
+    func()
+    times = []
+    for _ in range(repeat):
+        setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    setup()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return statistics.median(times), peak
+
+def _benchmark_size(nrad:int, nphi:int, nsnap:int, repeat:int)->List[Dict]:
+    r, phi = read.get_coords(0, 'none', True)
+    rho = read.get_data(0, 'none', True, 'rho').T
+    r_mid = 0.5*(r[1:] + r[:-1])
+    peaks = spirals.find_peaks(r, phi, rho, 0.0, 0.1)
+    r_analytic = np.linspace(0.4, 2.5, nrad)
+    phi_grid = np.linspace(-np.pi, np.pi, nrad*nphi)
+    cases = [
+        ('read.get_data', lambda: [read.get_data(i, 'none', True, 'rho') for i in range(nsnap)], nsnap, 'snapshots', read.close_all),
+        ('read.get_coords', lambda: read.get_coords(0, 'none', True), 1, 'calls', read.close_all),
+        ('spirals.find_peaks', lambda: spirals.find_peaks(r, phi, rho, 0.0, 0.1), nrad, 'rows', None),
+        ('spirals.reconstruct', lambda: spirals.reconstruct(np.log(r_mid), peaks), nrad, 'radii', None),
+        ('spirals.phi_peak_analytic_shadow', lambda: spirals.phi_peak_analytic_shadow(r_analytic, 0, 0.1, 0.15, 1.3), nrad, 'radii', None),
+        ('get_sound_speed', lambda: get_sound_speed(phi_grid, 0.1, 0.15, 1.3), nrad*nphi, 'points', None),
+    ]
+    results = []
+    for name, func, items, unit, setup in cases:
+        seconds, peak = measure(func, repeat, setup)
+        results.append({
+            'name': name,
+            'nrad': nrad,
+            'nphi': nphi,
+            'seconds': seconds,
+            'items': items,
+            'unit': unit,
+            'throughput': items / seconds,
+            'peak_bytes': peak
+        })
+    return results
+
+def run(sizes:List[Tuple[int,int]]=SIZES, nsnap:int=NSNAP, repeat:int=REPEAT)->Dict:
+    """
+    Run every benchmark at every grid size.
+
+    Parameters
+    ----------
+    sizes : list of tuple, optional
+        The (nrad, nphi) grids
+    nsnap : int, optional
+        The number of snapshots read per timing of get_data
+    repeat : int, optional
+        The number of timed calls
+
+    Returns
+    -------
+    dict
+        The environment and the result of each benchmark
+    """
+    data_path, cache_nbytes = read.DATA_PATH, tables.CACHE_NBYTES
+    # time the solver, not the table cache
+    tables.configure_cache(nbytes=0)
+    results = []
+    try:
+        for nrad, nphi in sizes:
+            with tempfile.TemporaryDirectory() as tmp:
+                read.close_all()
+                read.DATA_PATH = Path(tmp)
+                _write_snapshots(Path(tmp), nrad, nphi, nsnap)
+                results += _benchmark_size(nrad, nphi, nsnap, repeat)
+                read.close_all()
+    finally:
+        read.DATA_PATH = data_path
+        tables.configure_cache(nbytes=cache_nbytes)
+    return {
+        'environment': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'scipy': scipy.__version__,
+            'h5py': h5py.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor()
+        },
+        'results': results
+    }
+
+def compare(old:Dict, new:Dict)->List[Tuple[str,int,int,float]]:
+    """
+    Compare the throughput of two runs.
+
+    Parameters
+    ----------
+    old : dict
+        The baseline results, as returned by ``run``
+    new : dict
+        The new results
+
+    Returns
+    -------
+    list of tuple
+        The (name, nrad, nphi, speedup) of every benchmark in both runs
+    """
+    baseline = {(res['name'], res['nrad'], res['nphi']): res for res in old['results']}
+    speedups = []
+    for res in new['results']:
+        key = (res['name'], res['nrad'], res['nphi'])
+        if key in baseline:
+            speedups.append((*key, res['throughput'] / baseline[key]['throughput']))
+    return speedups
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark the hot paths on synthetic data.')
+    parser.add_argument('-o', '--output', type=Path, default=OUTFILE, help='The JSON file to write')
+    parser.add_argument('--sizes', nargs='+', default=[f'{nrad}x{nphi}' for nrad, nphi in SIZES], help='Grids to run, as NRADxNPHI')
+    parser.add_argument('--snapshots', type=int, default=NSNAP, help='Snapshots read per timing of get_data')
+    parser.add_argument('--repeat', type=int, default=REPEAT, help='Timed calls per benchmark')
+    parser.add_argument('--compare', type=Path, default=None, help='A previous JSON file to compare against')
+    args = parser.parse_args()
+    sizes = [tuple(int(n) for n in size.split('x')) for size in args.sizes]
+    report = run(sizes, args.snapshots, args.repeat)
+    for res in report['results']:
+        print(
+            f"{res['name']:<34} {res['nrad']:>5} x {res['nphi']:<5} "
+            f"{res['throughput']:>12.4g} {res['unit']}/s {res['peak_bytes']/1024**2:>9.2f} MiB"
+        )
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Wrote {args.output}')
+    if args.compare is not None:
+        with open(args.compare) as f:
+            old = json.load(f)
+        for name, nrad, nphi, speedup in compare(old, report):
+            print(f'{name:<34} {nrad:>5} x {nphi:<5} {speedup:>6.2f}x')
@@ -0,0 +1,84 @@
+"""
+Build the figures in a single process, so they share the data caches.
+
+Each figure script is run as ``__main__``, just as ``python {script}``
+would run it, so the scripts themselves need no changes. Snapshots,
+anomalies and spiral peaks that several figures need are then read or
+computed only once.
+"""
+
+import sys
+import time
+import runpy
+import traceback
+from typing import List
+import matplotlib
+matplotlib.use('agg')
+import matplotlib.pyplot as plt
+
+import paths
+import spirals
+import instrument
+
+# The figure scripts, built in this order
+FIGURES = sorted(path.name for path in paths.scripts.glob('plot_*.py'))
+# The number of find_peaks results shared between figures
+PEAKS_CACHE_SIZE = 64
+
+def run(script:str):
+    """
+    Run one figure script, undoing its changes to the matplotlib state.
+
+    Parameters
+    ----------
+    script : str
+        The file name of the script
+    """
+    with matplotlib.rc_context():
+        try:
+            runpy.run_path(str(paths.scripts / script), run_name='__main__')
+        finally:
+            plt.close('all')
+
+def build(scripts:List[str]=None)->List[str]:
+    """
+    Build several figures, carrying on past any that fail.
+    
+    With instrumentation enabled, each figure gets its own report.
+
+    Parameters
+    ----------
+    scripts : list of str, optional
+        The file names of the figure scripts. Defaults to all of them.
+
+    Returns
+    -------
+    list of str
+        The scripts that failed
+    """
+    spirals.configure_peaks_cache(PEAKS_CACHE_SIZE)
+    failed = []
+    for script in FIGURES if scripts is None else scripts:
+        start = time.perf_counter()
+        try:
+            run(script)
+        except Exception:
+            traceback.print_exc()
+            failed.append(script)
+        else:
+            print(f'Built {script} in {time.perf_counter() - start:.1f} s')
+        if instrument.ENABLED:
+            instrument.report(script)
+    return failed
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Build the figures in one process.')
+    parser.add_argument('scripts', nargs='*', help=f'The figure scripts to build, out of {", ".join(FIGURES)}')
+    args = parser.parse_args()
+    unknown = sorted(set(args.scripts) - set(FIGURES))
+    if unknown:
+        parser.error(f'Unknown figure scripts: {", ".join(unknown)}')
+    failed = build(args.scripts or None)
+    if failed:
+        sys.exit(f'Failed to build: {", ".join(failed)}')
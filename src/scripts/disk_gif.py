@@ -1,23 +1,42 @@
 
 
+import os
+import io
+import json
+import zlib
+import shutil
+import struct
+import hashlib
+import subprocess
+from pathlib import Path
+from collections import deque
+from typing import Dict, Iterator, List, Tuple
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
+import matplotlib
 import matplotlib.pyplot as plt
-from os import system
+from PIL import Image, GifImagePlugin
 from tqdm.auto import tqdm
 
 import paths
 import read
+import anomalies
+import raster
 
 
 OUTPATH = paths.figures / 'gif'
+# Records what each PNG frame was rendered from
+MANIFEST_PATH = OUTPATH / 'manifest.json'
 
 FIG_HEIGHT = 4
 FIG_WIDTH = 4
 CMAP = 'BrBG'
 INNER_RAD = 1
 DPI = 200
+FPS = 20
+# Frames rendered ahead of the writer, per worker
+PREFETCH = 2
 
-rho_initial = read.get_data(0, 'none', True, 'rho').T
 r, phi = read.get_coords(0, 'none', True)
 
 def r_transform(x):
@@ -25,50 +44,421 @@ def r_transform(x):
 
 
 
+class Renderer:
+    """
+    Draws the frames of one case on a single figure.
+    
+    The figure, axes and colorbar are built once. Each frame only gathers
+    the data into the image, rescales its colours and updates the time label.
+    """
+    def __init__(self, shadow:str, planet:bool):
+        self.shadow = shadow
+        self.planet = planet
+        # everything besides the data that changes how a frame looks
+        self.params = {
+            'shadow': shadow,
+            'planet': planet,
+            'fig_width': FIG_WIDTH,
+            'fig_height': FIG_HEIGHT,
+            'cmap': CMAP,
+            'inner_rad': INNER_RAD,
+            'dpi': DPI,
+            'renderer': 'raster',
+            'matplotlib': matplotlib.__version__
+        }
+        self.fig = plt.figure(figsize=(FIG_WIDTH, FIG_HEIGHT), dpi=DPI)
+        gs = self.fig.add_gridspec(1,11)
+        
+        main_ax = self.fig.add_subplot(gs[0, :8], projection='polar')
+        cbar_ax = self.fig.add_subplot(gs[0, 9])
+        
+        # each frame is written into this buffer instead of being cached
+        self._buffer = np.zeros_like(anomalies.get_baseline())
+        
+        logr = r_transform(np.log(r))
+        y_ticks = np.array([0.5,1,2])
+        main_ax.set_yticks(r_transform(np.log(y_ticks)))
+        main_ax.set_yticklabels(y_ticks,)
+        x_ticks = np.linspace(0, 2*np.pi, 4, endpoint=False)
+        main_ax.set_xticks(x_ticks)
+        main_ax.set_xticklabels([r"$0$", r"$\frac{\pi}{2}$", r"$\pi$", r"$\frac{3\pi}{2}$"],fontdict={'size':14})
+        main_ax.tick_params(axis='x',pad=-0)
+        
+        self.raster = raster.PolarRaster(main_ax, phi, logr, dpi=DPI)
+        self.mesh = self.raster.imshow(
+            self._buffer.T,
+            cmap = CMAP
+        )
+        self.fig.colorbar(self.mesh, cax=cbar_ax, label='$\\Delta \\rho$ (%)',shrink=0.6)
+        self.fig.subplots_adjust(right=0.85)
+        self.time_label = self.fig.text(0.06,0.11,'',fontdict={'size':14})
+    
+    def _show(self, index:int):
+        self.raster.update(self.mesh, self._buffer.T, autoscale=True)
+        self.time_label.set_text(f'$t = {index/4.0:.2f}~P_{{orb}}$')
+    
+    def _digest(self, index:int)->str:
+        digest = hashlib.blake2b(self._buffer.tobytes())
+        digest.update(json.dumps({**self.params, 'index': int(index)}, sort_keys=True).encode())
+        return digest.hexdigest()
+    
+    def update(self, index:int):
+        """
+        Show a snapshot on the figure.
+        
+        Parameters
+        ----------
+        index : int
+            The index of the snapshot
+        """
+        anomalies.anomaly(index, self.shadow, self.planet, out=self._buffer)
+        self._show(index)
+    
+    def render(self, index:int, filename:str, known:str=None)->str:
+        """
+        Draw one snapshot and save it, unless it is already saved.
+        
+        Parameters
+        ----------
+        index : int
+            The index of the snapshot
+        filename : str
+            The file to save the frame to
+        known : str, optional
+            The digest the existing file was rendered from, if any
+        
+        Returns
+        -------
+        str
+            A digest of the data and parameters the frame is rendered from
+        """
+        anomalies.anomaly(index, self.shadow, self.planet, out=self._buffer)
+        digest = self._digest(index)
+        if digest == known and os.path.exists(filename):
+            return digest
+        self._show(index)
+        self.fig.savefig(filename,dpi=DPI)
+        return digest
+    
+    def draw(self, index:int)->np.ndarray:
+        """
+        Draw one snapshot in memory.
+        
+        Parameters
+        ----------
+        index : int
+            The index of the snapshot
+        
+        Returns
+        -------
+        np.ndarray
+            The RGBA pixels of the frame
+        """
+        self.update(index)
+        self.fig.canvas.draw()
+        return np.array(self.fig.canvas.buffer_rgba())
+    
+    def close(self):
+        plt.close(self.fig)
+
 def main(index:int, shadow:str, planet:bool,filename:str):
+    renderer = Renderer(shadow, planet)
+    renderer.render(index, filename)
+    renderer.close()
+
+_renderer:Renderer = None
+
+def _init_worker(shadow:str, planet:bool):
+    global _renderer
+    _renderer = Renderer(shadow, planet)
+
+def _render(frame:Tuple[int,str,str])->str:
+    return _renderer.render(*frame)
+
+def _draw(index:int)->np.ndarray:
+    return _renderer.draw(index)
+
+def load_manifest(path:Path=MANIFEST_PATH)->Dict[str,str]:
+    """
+    Load the digest of each rendered frame, keyed by its file name.
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_manifest(manifest:Dict[str,str], path:Path=MANIFEST_PATH):
+    """
+    Save the manifest, replacing the old one in a single step.
+    """
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def render_frames(
+    shadow:str,
+    planet:bool,
+    indices:List[int],
+    filenames:List[str],
+    jobs:int=1,
+    manifest_path:Path=MANIFEST_PATH
+):
+    """
+    Render many frames of one case, optionally in a process pool.
     
-    fig = plt.figure(figsize=(FIG_WIDTH, FIG_HEIGHT))
-    gs = fig.add_gridspec(1,11)
-    time = index/4.0
+    Frames whose data and render parameters match the manifest are not
+    redrawn. The manifest is saved after every frame, so an interrupted
+    run picks up where it stopped.
     
-    main_ax = fig.add_subplot(gs[0, :8], projection='polar')
-    cbar_ax = fig.add_subplot(gs[0, 9])
+    Parameters
+    ----------
+    shadow : str
+        'none', 'narrow', or 'wide'
+    planet : bool
+        True if the planet is present
+    indices : list of int
+        The snapshot of each frame
+    filenames : list of str
+        The file to save each frame to
+    jobs : int, optional
+        The number of worker processes, each with its own figure
+    manifest_path : Path, optional
+        The manifest of the frames, kept next to them
+    """
+    manifest_path = Path(manifest_path)
+    manifest = load_manifest(manifest_path)
+    keys = [os.path.relpath(filename, manifest_path.parent) for filename in filenames]
+    frames = [(index, filename, manifest.get(key)) for index, filename, key in zip(indices, filenames, keys)]
+    progress = dict(desc=shadow, total=len(frames))
+    if jobs == 1:
+        _init_worker(shadow, planet)
+        digests = map(_render, frames)
+    else:
+        chunksize = max(1, len(frames) // (4*jobs))
+        executor = ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(shadow, planet))
+        digests = executor.map(_render, frames, chunksize=chunksize)
+    try:
+        for key, digest in tqdm(zip(keys, digests), **progress):
+            if manifest.get(key) != digest:
+                manifest[key] = digest
+                save_manifest(manifest, manifest_path)
+    finally:
+        if jobs == 1:
+            _renderer.close()
+        else:
+            executor.shutdown(cancel_futures=True)
+
+def remove_stale_frames(shadow:str, filenames:List[str], manifest_path:Path=MANIFEST_PATH):
+    """
+    Delete the PNG frames of a case that are no longer wanted.
+    """
+    manifest_path = Path(manifest_path)
+    manifest = load_manifest(manifest_path)
+    keep = {Path(filename).resolve() for filename in filenames}
+    for path in manifest_path.parent.glob(f'{shadow}_*.png'):
+        if path.resolve() not in keep:
+            path.unlink()
+            manifest.pop(os.path.relpath(path, manifest_path.parent), None)
+    save_manifest(manifest, manifest_path)
+
+def iter_frames(
+    shadow:str,
+    planet:bool,
+    indices:List[int],
+    jobs:int=1
+)->Iterator[np.ndarray]:
+    """
+    Draw the frames of one case in memory, in order.
     
-    rho = read.get_data(index, shadow, planet, 'rho').T
-    anomaly = (rho - rho_initial) / rho_initial * 100
+    Only a few frames per worker are held at a time, however many
+    frames there are.
     
-    logr = r_transform(np.log(r))
-    y_ticks = np.array([0.5,1,2])
-    main_ax.set_yticks(r_transform(np.log(y_ticks)))
-    main_ax.set_yticklabels(y_ticks,)
-    x_ticks = np.linspace(0, 2*np.pi, 4, endpoint=False)
-    main_ax.set_xticks(x_ticks)
-    main_ax.set_xticklabels([r"$0$", r"$\frac{\pi}{2}$", r"$\pi$", r"$\frac{3\pi}{2}$"],fontdict={'size':14})
-    main_ax.tick_params(axis='x',pad=-0)
+    Parameters
+    ----------
+    shadow : str
+        'none', 'narrow', or 'wide'
+    planet : bool
+        True if the planet is present
+    indices : list of int
+        The snapshot of each frame
+    jobs : int, optional
+        The number of worker processes, each with its own figure
+    
+    Yields
+    ------
+    np.ndarray
+        The RGBA pixels of each frame
+    """
+    if jobs == 1:
+        renderer = Renderer(shadow, planet)
+        try:
+            for index in indices:
+                yield renderer.draw(index)
+        finally:
+            renderer.close()
+        return
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(shadow, planet)) as executor:
+        pending = deque()
+        for index in indices:
+            pending.append(executor.submit(_draw, index))
+            if len(pending) >= PREFETCH*jobs:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
 
+def write_gif(frames:Iterator[np.ndarray], filename:str, fps:float=FPS):
+    """
+    Write frames to an animated GIF as they arrive.
     
-    im = main_ax.pcolormesh(
-        phi, logr, anomaly,
-        cmap = CMAP
-    )
-    fig.colorbar(im, cax=cbar_ax, label='$\\Delta \\rho$ (%)',shrink=0.6)
-    fig.subplots_adjust(right=0.85)
-    fig.text(0.06,0.11,f'$t = {time:.2f}~P_{{orb}}$',fontdict={'size':14})
+    Parameters
+    ----------
+    frames : iterator of np.ndarray
+        The RGBA pixels of each frame
+    filename : str
+        The file to write
+    fps : float, optional
+        The frames per second
+    """
+    tmp_filename = f'{filename}.{os.getpid()}.tmp'
+    with open(tmp_filename, 'wb') as f:
+        for n, frame in enumerate(frames):
+            # each frame gets its own palette
+            image = Image.fromarray(frame[..., :3]).quantize()
+            if n == 0:
+                header, _ = GifImagePlugin.getheader(image, info={'loop': 0})
+                f.writelines(header)
+            f.writelines(GifImagePlugin.getdata(image, duration=1000/fps, include_color_table=True))
+        f.write(b';')
+    os.replace(tmp_filename, filename)
+
+def _png_chunk(kind:bytes, data:bytes)->bytes:
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+def _read_png_chunks(data:bytes)->Iterator[Tuple[bytes,bytes]]:
+    """
+    Split an encoded PNG into its (type, data) chunks.
+    """
+    position = 8
+    while position < len(data):
+        length, = struct.unpack('>I', data[position:position+4])
+        kind = data[position+4:position+8]
+        yield kind, data[position+8:position+8+length]
+        position += 12 + length
+
+def write_apng(frames:Iterator[np.ndarray], filename:str, fps:float=FPS):
+    """
+    Write frames to an animated PNG as they arrive.
+    
+    Each frame is encoded by PIL as a PNG of its own, and its image data
+    is copied into the animation. The frame count in the header is filled
+    in once the last frame is written.
+    
+    Parameters
+    ----------
+    frames : iterator of np.ndarray
+        The RGBA pixels of each frame
+    filename : str
+        The file to write
+    fps : float, optional
+        The frames per second
+    """
+    tmp_filename = f'{filename}.{os.getpid()}.tmp'
+    # the delay of each frame, in milliseconds
+    delay = (round(1000/fps), 1000)
+    sequence = 0
+    with open(tmp_filename, 'wb') as f:
+        for n, frame in enumerate(frames):
+            buffer = io.BytesIO()
+            Image.fromarray(frame).save(buffer, format='PNG')
+            chunks = list(_read_png_chunks(buffer.getvalue()))
+            height, width, _ = frame.shape
+            if n == 0:
+                shape = frame.shape
+                f.write(b'\x89PNG\r\n\x1a\n')
+                f.write(_png_chunk(b'IHDR', dict(chunks)[b'IHDR']))
+                actl_position = f.tell()
+                f.write(_png_chunk(b'acTL', struct.pack('>II', 0, 0)))
+            elif frame.shape != shape:
+                raise ValueError(f'Frame {n} has shape {frame.shape}, not {shape}')
+            f.write(_png_chunk(b'fcTL', struct.pack('>IIIIIHHBB', sequence, width, height, 0, 0, *delay, 0, 0)))
+            sequence += 1
+            for kind, data in chunks:
+                if kind != b'IDAT':
+                    continue
+                if n == 0:
+                    f.write(_png_chunk(b'IDAT', data))
+                else:
+                    f.write(_png_chunk(b'fdAT', struct.pack('>I', sequence) + data))
+                    sequence += 1
+        if sequence == 0:
+            raise ValueError('No frames to write')
+        f.write(_png_chunk(b'IEND', b''))
+        f.seek(actl_position)
+        f.write(_png_chunk(b'acTL', struct.pack('>II', n + 1, 0)))
+    os.replace(tmp_filename, filename)
+
+def write_mp4(frames:Iterator[np.ndarray], filename:str, fps:float=FPS):
+    """
+    Pipe frames to ffmpeg as they arrive.
     
-    fig.savefig(filename,dpi=DPI)
-    plt.close(fig)
+    Parameters
+    ----------
+    frames : iterator of np.ndarray
+        The RGBA pixels of each frame
+    filename : str
+        The file to write
+    fps : float, optional
+        The frames per second
+    """
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        raise RuntimeError('MP4 output needs ffmpeg, which was not found.')
+    frames = iter(frames)
+    first = next(frames)
+    height, width, _ = first.shape
+    tmp_filename = f'{filename}.{os.getpid()}.tmp.mp4'
+    command = [
+        ffmpeg, '-y', '-loglevel', 'error',
+        '-f', 'rawvideo', '-pix_fmt', 'rgba', '-s', f'{width}x{height}', '-r', str(fps), '-i', '-',
+        # yuv420p needs even dimensions
+        '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-pix_fmt', 'yuv420p', tmp_filename
+    ]
+    with subprocess.Popen(command, stdin=subprocess.PIPE) as process:
+        process.stdin.write(first.tobytes())
+        for frame in frames:
+            process.stdin.write(frame.tobytes())
+        process.stdin.close()
+    if process.returncode != 0:
+        raise RuntimeError(f'ffmpeg failed with exit code {process.returncode}')
+    os.replace(tmp_filename, filename)
+
+WRITERS = {'gif': write_gif, 'apng': write_apng, 'mp4': write_mp4}
 
 if __name__ in '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Render the disk animations.')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='The number of worker processes')
+    parser.add_argument('-f', '--format', choices=['png', *WRITERS], default='png', help='Write one PNG per frame, or an animation')
+    parser.add_argument('--every', type=int, default=1, help='Only use every Nth snapshot')
+    parser.add_argument('--fps', type=float, default=FPS, help='The frames per second of the animation')
+    args = parser.parse_args()
+    
     shadows = ['none','wide']
     # shadows = ['wide']
-    indicies = np.arange(0,400,1)
+    indicies = np.arange(0,400,args.every)
     
     if not OUTPATH.exists():
         OUTPATH.mkdir()
     
     for shadow in shadows:
-        system(f'rm {OUTPATH}/{shadow}_*.png')
-        for n, index in enumerate(tqdm(indicies, desc=shadow,total=len(indicies))):
-            filename = OUTPATH / f'{shadow}_{n:03}.png'
-            main(index, shadow, True, filename)
-    
\ No newline at end of file
+        if args.format == 'png':
+            filenames = [OUTPATH / f'{shadow}_{n:03}.png' for n in range(len(indicies))]
+            remove_stale_frames(shadow, filenames)
+            render_frames(shadow, True, indicies, filenames, args.jobs)
+            continue
+        filename = OUTPATH / f'{shadow}.{args.format}'
+        frames = tqdm(iter_frames(shadow, True, indicies, args.jobs), desc=shadow, total=len(indicies))
+        WRITERS[args.format](frames, filename, args.fps)
+        print(f'Wrote {filename}')
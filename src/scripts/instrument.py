@@ -0,0 +1,192 @@
+"""
+Opt-in counters and timers for the I/O and compute paths.
+
+Set ``SHADOW_SPIRALS_PROFILE=1`` before running a script, or wrap code in
+``with instrument.collect(name):``, to record file opens, bytes read and
+extraction times per case, and the calls, wall time and CPU time of the
+functions decorated with ``timed``. A summary is printed and saved as
+JSON in ``REPORT_DIR`` when the script exits or the block ends.
+
+While disabled, a timed function costs one extra call and a flag check.
+Counters are kept per process, so work done in pool workers is not seen.
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import functools
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Callable, Dict, List
+
+import paths
+
+ENV_VAR = 'SHADOW_SPIRALS_PROFILE'
+ENABLED = os.environ.get(ENV_VAR, '') not in ('', '0')
+REPORT_DIR = paths.output / 'profile'
+
+# metric -> case -> total
+_counters:Dict[str,Dict[str,float]] = {}
+# function -> [calls, wall seconds, cpu seconds]
+_timers:Dict[str,List[float]] = {}
+# the wall and cpu clocks when recording started
+_start = [time.perf_counter(), time.process_time()]
+
+def count(metric:str, case:str, amount:float=1):
+    """
+    Add to a per-case counter.
+
+    Parameters
+    ----------
+    metric : str
+        The name of the counter, such as 'opens' or 'bytes_read'
+    case : str
+        The name of the case
+    amount : float, optional
+        The amount to add
+    """
+    if not ENABLED:
+        return
+    totals = _counters.setdefault(metric, {})
+    totals[case] = totals.get(case, 0) + amount
+
+def timed(func:Callable)->Callable:
+    """
+    Record the calls, wall time and CPU time of a function.
+
+    Times are inclusive, so a timed function called by another counts
+    towards both.
+    """
+    name = f'{func.__module__}.{func.__qualname__}'
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not ENABLED:
+            return func(*args, **kwargs)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timer = _timers.setdefault(name, [0, 0.0, 0.0])
+            timer[0] += 1
+            timer[1] += time.perf_counter() - wall
+            timer[2] += time.process_time() - cpu
+    return wrapper
+
+def reset():
+    """
+    Forget everything recorded so far.
+    """
+    _counters.clear()
+    _timers.clear()
+    _start[:] = [time.perf_counter(), time.process_time()]
+
+def get_summary()->dict:
+    """
+    Get everything recorded so far.
+
+    Returns
+    -------
+    dict
+        The total wall and CPU seconds, the per-case counters, and the
+        calls, wall and CPU seconds of each timed function
+    """
+    return {
+        'wall_seconds': time.perf_counter() - _start[0],
+        'cpu_seconds': time.process_time() - _start[1],
+        'counters': {metric: dict(totals) for metric, totals in _counters.items()},
+        'functions': {
+            name: {'calls': calls, 'wall_seconds': wall, 'cpu_seconds': cpu}
+            for name, (calls, wall, cpu) in _timers.items()
+        }
+    }
+
+def format_summary(summary:dict)->str:
+    """
+    Lay out a summary from ``get_summary`` as text tables.
+    """
+    lines = [
+        f'{"function":<44} {"calls":>8} {"wall s":>10} {"cpu s":>10}',
+        f'{"(total)":<44} {"":>8} {summary["wall_seconds"]:>10.3f} {summary["cpu_seconds"]:>10.3f}'
+    ]
+    functions = sorted(summary['functions'].items(), key=lambda item: -item[1]['wall_seconds'])
+    for name, timer in functions:
+        lines.append(f'{name:<44} {timer["calls"]:>8} {timer["wall_seconds"]:>10.3f} {timer["cpu_seconds"]:>10.3f}')
+    counters = summary['counters']
+    if counters:
+        metrics = sorted(counters)
+        cases = sorted({case for totals in counters.values() for case in totals})
+        lines.append('')
+        lines.append(f'{"case":<16}' + ''.join(f' {metric:>16}' for metric in metrics))
+        for case in cases:
+            lines.append(f'{case:<16}' + ''.join(f' {counters[metric].get(case, 0):>16.6g}' for metric in metrics))
+    return '\n'.join(lines)
+
+def report(name:str=None, directory:Path=None)->dict:
+    """
+    Print and save a summary, then start afresh.
+
+    Parameters
+    ----------
+    name : str, optional
+        The name of the report. Defaults to the running script.
+    directory : Path, optional
+        Where to save the JSON report. Defaults to ``REPORT_DIR``.
+
+    Returns
+    -------
+    dict
+        The summary
+    """
+    name = name or Path(sys.argv[0]).stem or 'interactive'
+    directory = REPORT_DIR if directory is None else Path(directory)
+    summary = {'name': name, **get_summary()}
+    print(f'Profile of {name}', file=sys.stderr)
+    print(format_summary(summary), file=sys.stderr)
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f'{Path(name).stem}.json'
+    tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(summary, f, indent=2)
+    os.replace(tmp_path, path)
+    reset()
+    return summary
+
+@contextmanager
+def collect(name:str=None, directory:Path=None):
+    """
+    Record everything within the block and report it at the end.
+
+    Parameters
+    ----------
+    name : str, optional
+        The name of the report. Defaults to the running script.
+    directory : Path, optional
+        Where to save the JSON report. Defaults to ``REPORT_DIR``.
+    """
+    global ENABLED
+    previous = ENABLED
+    # keep what was recorded before the block for the exit report
+    saved = get_summary()
+    start = list(_start)
+    reset()
+    ENABLED = True
+    try:
+        yield
+    finally:
+        ENABLED = previous
+        report(name, directory)
+        for metric, totals in saved['counters'].items():
+            _counters[metric] = totals
+        for func, timer in saved['functions'].items():
+            _timers[func] = [timer['calls'], timer['wall_seconds'], timer['cpu_seconds']]
+        _start[:] = start
+
+def _report_at_exit():
+    if ENABLED and (_counters or _timers):
+        report()
+
+atexit.register(_report_at_exit)
+# workers start empty rather than with a copy of the parent's records
+os.register_at_fork(after_in_child=reset)
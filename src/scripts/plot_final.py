@@ -7,6 +7,7 @@ import matplotlib.pyplot as plt
 
 import paths
 import read
+import anomalies
 
 
 OUTFILE = paths.figures / "final_density.pdf"
@@ -35,9 +36,7 @@ axes = [ax_none,ax_narrow_with,ax_narrow_without,ax_wide_with,ax_wide_without]
 
 ax_cbar = fig.add_subplot(gs[1, 0])
 
-densities = np.array([(read.get_data(INDEX, shadow=_shadow, planet=_planet, var_name=VAR_NAME)) for _shadow,_planet in zip(SHADOWS,PLANETS)])
-initial_density = read.get_data(0, 'none', True, VAR_NAME)
-densities_anomaly = (densities - initial_density) / initial_density * 100
+densities_anomaly = np.array([anomalies.anomaly(INDEX, _shadow, _planet, VAR_NAME) for _shadow,_planet in zip(SHADOWS,PLANETS)])
 vmin = np.min(densities_anomaly)
 vmax = np.max(densities_anomaly)
 max_v = max(np.abs(vmax),np.abs(vmin))
@@ -49,8 +48,7 @@ for _ax, _shadow, _planet in zip(axes, SHADOWS, PLANETS):
     def r_transform(x):
         return x - np.log10(r[0]) + INNER_RAD
     log_r = r_transform(np.log10(r))
-    density = read.get_data(INDEX, _shadow, _planet, VAR_NAME)
-    density_anomaly = (density - initial_density) / initial_density * 100
+    density_anomaly = anomalies.anomaly(INDEX, _shadow, _planet, VAR_NAME)
     y_ticks = np.array([0.5,1,2,])
     _ax.set_yticks(r_transform(np.log10(y_ticks)))
     _ax.set_yticklabels(y_ticks,)
@@ -7,6 +7,7 @@ import matplotlib.pyplot as plt
 
 import paths
 import read
+import anomalies
 
 
 OUTFILE = paths.figures / "rings_sh.png"
@@ -32,9 +33,7 @@ axes = [ax_narrow, ax_wide]
 
 ax_cbar = fig.add_subplot(gs[20, 0])
 
-densities = np.array([(read.get_data(INDEX, shadow=_shadow, planet=False, var_name=VAR_NAME)) for _shadow in SHADOWS])
-initial_density = read.get_data(0, 'none', True, VAR_NAME)
-densities_anomaly = (densities - initial_density) / initial_density * 100
+densities_anomaly = np.array([anomalies.anomaly(INDEX, _shadow, False, VAR_NAME) for _shadow in SHADOWS])
 vmin = np.min(densities_anomaly)
 vmax = np.max(densities_anomaly)
 max_v = max(np.abs(vmax),np.abs(vmin))
@@ -46,8 +45,7 @@ for _ax, _shadow in zip(axes, SHADOWS):
     def r_transform(x):
         return x - np.log10(r[0]) + INNER_RAD
     log_r = r_transform(np.log10(r))
-    density = read.get_data(INDEX, _shadow, False, VAR_NAME)
-    density_anomaly = (density - initial_density) / initial_density * 100
+    density_anomaly = anomalies.anomaly(INDEX, _shadow, False, VAR_NAME)
     y_ticks = np.array([0.5,1,2,])
     _ax.set_yticks(r_transform(np.log10(y_ticks)))
     _ax.set_yticklabels(y_ticks,)
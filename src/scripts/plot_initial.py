@@ -29,7 +29,7 @@ ax_narrow = fig.add_subplot(gs[0, 10:18], projection='polar')
 ax_wide = fig.add_subplot(gs[0, 20:28], projection='polar')
 ax_cbar = fig.add_subplot(gs[0, 30])
 
-temperatures = np.vstack([(read.get_data(INDEX, _name, False, VAR_NAME)) for _name in NAMES])
+temperatures = np.array([read.get_fields(INDEX, _name, False, [VAR_NAME])[VAR_NAME] for _name in NAMES])
 tmax = np.max(temperatures)
 temperatures = temperatures / tmax
 vmin = np.min(temperatures)
@@ -40,7 +40,7 @@ for i,(_ax, _name, _title) in enumerate(zip([ax_none, ax_narrow, ax_wide], NAMES
     def r_transform(x):
         return x - np.log10(r[0]) + INNER_RAD
     log_r = r_transform(np.log10(r))
-    temp = read.get_data(INDEX, _name, False, VAR_NAME) / tmax
+    temp = temperatures[i]
     y_ticks = np.array([0.5,1,2,])
     _ax.set_yticks(r_transform(np.log10(y_ticks)))
     _ax.set_yticklabels(y_ticks,)
@@ -4,6 +4,7 @@ from matplotlib import patches
 
 import paths
 import read
+import anomalies
 import colors
 
 
@@ -28,19 +29,20 @@ fig = plt.figure(figsize=(FIG_WIDTH, FIG_HEIGHT))
 
 ax = fig.add_subplot(111)
 
-for i in np.arange(100, 400, 1):
-    rho_initial = read.get_data(0, 'none', True, 'rho')
-    rho_narrow = read.get_data(i, 'narrow', False, 'rho')
-    rho_wide = read.get_data(i, 'wide', False, 'rho')
+index_initial, shadow_initial, planet_initial = anomalies.BASELINE
+rho_initial = read.get_radial_profile(shadow_initial, planet_initial, VAR_NAME, I_PHI, index_initial, index_initial+1)[0]
+rho_narrow = read.get_radial_profile('narrow', False, VAR_NAME, I_PHI, 100, 400)
+rho_wide = read.get_radial_profile('wide', False, VAR_NAME, I_PHI, 100, 400)
 
-    anomaly_narrow = (rho_narrow - rho_initial) / rho_initial * 100
-    anomaly_wide = (rho_wide - rho_initial) / rho_initial * 100
+anomaly_narrow = (rho_narrow - rho_initial) / rho_initial * 100
+anomaly_wide = (rho_wide - rho_initial) / rho_initial * 100
 
-    r_mid = r[:-1] + np.diff(r)/2
-    ln_r = np.log(r_mid)
+r_mid = r[:-1] + np.diff(r)/2
+ln_r = np.log(r_mid)
 
-    ax.plot(ln_r,anomaly_narrow[I_PHI,:],lw=1,c=colors.dark_orange,alpha=0.05)
-    ax.plot(ln_r,anomaly_wide[I_PHI,:],lw=1,c=colors.teal,alpha=0.05)
+for _narrow, _wide in zip(anomaly_narrow, anomaly_wide):
+    ax.plot(ln_r,_narrow,lw=1,c=colors.dark_orange,alpha=0.05)
+    ax.plot(ln_r,_wide,lw=1,c=colors.teal,alpha=0.05)
 ax.text(0.4,4,f'$\\phi = {phi[I_PHI]:.2f}$',fontdict={'size':14})
 ax.set_xlabel('$\\ln(r)$',fontdict={'size':14})
 ax.set_ylabel('$\\Delta \\rho$ (%)',fontdict={'size':14})
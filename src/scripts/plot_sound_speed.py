@@ -15,10 +15,82 @@ H = 0.9
 N_PHI = 1000
 plt.style.use('bmh')
 
-def get_sound_speed(_phi:np.ndarray,h:float,a:float,b:float)->np.ndarray:
+def _check_parameters(h:np.ndarray,a:np.ndarray,b:np.ndarray):
+    """
+    Make sure the sound speed profile is well defined for every parameter set.
+    """
+    if np.any(h < 0):
+        raise ValueError('The sound speed reduction factor h must be non-negative.')
+    if np.any(a < 0) or np.any(b < 0):
+        raise ValueError('The half-widths a and b must be non-negative.')
+    if np.any(a + b > 0.5*np.pi):
+        raise ValueError('The shadowed and unshadowed regions overlap (a + b > pi/2).')
+
+def get_sound_speed(_phi:np.ndarray,h:float,a:float,b:float,out:np.ndarray=None)->np.ndarray:
     """
     Get the sound speed as a function of phi.
     
+    The sound speed depends only on the distance ``d`` from phi to the
+    nearest multiple of pi. It is ``h`` for ``d <= a``, 1 for
+    ``d >= pi/2 - b``, and a raised cosine in between. The parameters
+    broadcast against phi, so ``h[:,None]`` with ``phi[None,:]`` gives
+    a whole (nparam, nphi) grid in one call.
+    
+    Parameters
+    ----------
+    phi : np.ndarray
+        The azimuthal angle.
+    h : float or np.ndarray
+        The sound speed reduction factor.
+    a : float or np.ndarray
+        The half-width of the shadowed region.
+    b : float or np.ndarray
+        The half-width of the unshadowed region.
+    out : np.ndarray, optional
+        A buffer of the broadcast shape to write the result into.
+    
+    Returns
+    -------
+    cs : np.ndarray
+        The sound speed.
+    """
+    h, a, b = (np.asarray(x, dtype=float) for x in (h, a, b))
+    _check_parameters(h, a, b)
+    # with no transition region the profile is a step at d = a
+    scale = 2*np.pi / np.maximum(np.pi - 2*b - 2*a, 1e-300)
+    if out is None:
+        shape = np.broadcast_shapes(np.shape(_phi), h.shape, a.shape, b.shape)
+        out = np.empty(shape, dtype=np.result_type(_phi, 1.0))
+    np.add(_phi, 0.5*np.pi, out=out)
+    np.mod(out, np.pi, out=out)
+    np.subtract(out, 0.5*np.pi, out=out)
+    np.abs(out, out=out)
+    np.subtract(out, a, out=out)
+    np.multiply(out, scale, out=out)
+    np.clip(out, 0, np.pi, out=out)
+    np.cos(out, out=out)
+    np.multiply(out, -0.5*(1-h), out=out)
+    np.add(out, 0.5*(1+h), out=out)
+    return out
+
+def _integrate_half_period(d:np.ndarray,h:float,a:float,b:float)->np.ndarray:
+    """
+    The integral of the sound speed from 0 to ``d``, for 0 <= d <= pi/2.
+    """
+    l = np.asarray(np.pi - 2*b - 2*a, dtype=float)
+    t = np.clip(d - a, 0, l/2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        transition = np.where(l > 0, 0.5*(t - l/(2*np.pi) * np.sin(2*np.pi/l * t)), 0.)
+    unshadow = np.maximum(d - (0.5*np.pi - b), 0)
+    return h*d + (1-h) * (transition + unshadow)
+
+def antiderivative_sound_speed(_phi:np.ndarray,h:float,a:float,b:float)->np.ndarray:
+    """
+    The integral of the sound speed from 0 to phi, for any phi.
+    
+    The sound speed is even and has period pi, so each full period
+    contributes twice the integral over half a period.
+    
     Parameters
     ----------
     phi : np.ndarray
@@ -32,26 +104,41 @@ def get_sound_speed(_phi:np.ndarray,h:float,a:float,b:float)->np.ndarray:
     
     Returns
     -------
-    cs : np.ndarray
-        The sound speed.
+    np.ndarray
+        The integral of the sound speed.
     """
-    shadow_region = np.abs(np.sin(_phi)) <= np.sin(a)
-    unshadow_region = np.abs(np.cos(_phi)) <= np.sin(b)
-    transition_region = ~(shadow_region | unshadow_region)
-    cs = np.ones_like(_phi) * -1
-    cs = np.where(shadow_region, h, cs)
-    cs = np.where(unshadow_region, 1.0, cs)
-    m = np.zeros_like(_phi)
-    m = np.where(_phi>0.5*np.pi, -1.0, m)
-    m = np.where(_phi<-0.5*np.pi, 1.0, m)
-    l = np.pi - 2*b - 2*a
-    cs = np.where(
-        transition_region,
-        h + 0.5*(1-h) * (1 - np.cos(2*np.pi/l * (np.abs(_phi + m*np.pi) - a))),
-        cs
-    )
-    assert np.all(cs >= 0), 'Some sounds speed values are still negative!'
-    return cs
+    h, a, b = (np.asarray(x, dtype=float) for x in (h, a, b))
+    _check_parameters(h, a, b)
+    _phi = np.asarray(_phi, dtype=float)
+    n = np.round(_phi / np.pi)
+    x = _phi - n*np.pi
+    half_period = _integrate_half_period(0.5*np.pi, h, a, b)
+    return 2*n*half_period + np.sign(x)*_integrate_half_period(np.abs(x), h, a, b)
+
+def integrate_sound_speed(phi0:np.ndarray,phi1:np.ndarray,h:float,a:float,b:float)->np.ndarray:
+    """
+    Integrate the sound speed from phi0 to phi1 exactly.
+    
+    Parameters
+    ----------
+    phi0 : np.ndarray
+        The lower limits of integration.
+    phi1 : np.ndarray
+        The upper limits of integration.
+    h : float
+        The sound speed reduction factor.
+    a : float
+        The half-width of the shadowed region.
+    b : float
+        The half-width of the unshadowed region.
+    
+    Returns
+    -------
+    np.ndarray
+        The integral of the sound speed.
+    """
+    return antiderivative_sound_speed(phi1, h, a, b) - antiderivative_sound_speed(phi0, h, a, b)
+
 if __name__ in '__main__':
     phi = np.linspace(-np.pi, np.pi, N_PHI)
     wide_shadow = 0.0
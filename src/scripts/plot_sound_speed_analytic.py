@@ -10,6 +10,7 @@ import paths
 import colors
 import read
 import spirals
+import sweep
 from plot_sound_speed import get_sound_speed
 a = 0
 b = 0
@@ -26,7 +27,6 @@ A = [0,0.15]
 B = [0,1.3]
 COLOR = [colors.teal, colors.dark_orange]
 NAME = ['wide', 'narrow']
-NDIFF = 1
 
 r = np.linspace(0.4,2.5,1000)
 
@@ -36,11 +36,11 @@ ax = fig.add_subplot(gs[:,0])
 zax = fig.add_subplot(gs[1,1])
 fig.subplots_adjust(left=0.18,wspace=0.25)
 
-for h, ls in zip(H,LS):
-    for a, b, c,n in zip(A,B,COLOR,NAME):
-        phi = spirals.phi_peak_analytic_shadow(r,PHI_PLANET,h,a,b)
-        _logr, _dphidr = spirals.central_difference(np.log(r),phi,NDIFF)
-        _zeta = np.arctan(np.abs(1/_dphidr))
+shapes = sweep.sweep(r,np.array(H[:len(LS)])[:,None],A,B,PHI_PLANET)
+for h, ls, row in zip(H,LS,shapes):
+    for a, b, c,n,shape in zip(A,B,COLOR,NAME,row):
+        phi, _zeta = shape['phi'], shape['zeta']
+        _logr = np.log(r)
         before = _logr < -0.1
         after = _logr > 0.1
         for reg in (before,after):
@@ -61,9 +61,8 @@ for h, ls in zip(H,LS):
         ax.plot(phi[after_planet],np.log(r)[after_planet],c=c,ls=ls,label=label)
 for h in [1.0]:
     for a, b in zip([0.0],[0.0]):
-        phi = spirals.phi_peak_analytic_shadow(r,PHI_PLANET,h,a,b)
-        _logr, _dphidr = spirals.central_difference(np.log(r),phi,NDIFF)
-        _zeta = np.arctan(np.abs(1/_dphidr))
+        phi, _zeta = spirals.solve_analytic_shadow(r,PHI_PLANET,h,a,b)
+        _logr = np.log(r)
         before = _logr < -0.1
         after = _logr > 0.1
         for reg in (before,after):
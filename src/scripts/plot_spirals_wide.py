@@ -7,6 +7,7 @@ import matplotlib.pyplot as plt
 
 import paths
 import read
+import anomalies
 import spirals
 
 OUTFILE = paths.figures / "spirals_wide.pdf"
@@ -36,16 +37,11 @@ r_mid = r[:-1] + np.diff(r)/2
 logr = np.log10(r)
 logr_mid = np.log10(r_mid)
 
-# densities
-initial_density = read.get_data(0, 'none', True, 'rho').T
-planet_only_density = read.get_data(INDEX, 'none', True, 'rho').T
-shadow_only_density = read.get_data(INDEX, SHADOW, False, 'rho').T
-both_density = read.get_data(INDEX, SHADOW, True, 'rho').T
-
-planet_only_anomaly = (planet_only_density - initial_density) / initial_density * 100
-shadow_only_anomaly = (shadow_only_density - initial_density) / initial_density * 100
-both_anomaly = (both_density - initial_density) / initial_density * 100
-residual_anomaly = (both_density - shadow_only_density) / initial_density * 100
+# density anomalies
+planet_only_anomaly = anomalies.anomaly(INDEX, 'none', True).T
+shadow_only_anomaly = anomalies.anomaly(INDEX, SHADOW, False).T
+both_anomaly = anomalies.anomaly(INDEX, SHADOW, True).T
+residual_anomaly = anomalies.residual(INDEX, SHADOW).T
 
 vmax = max(np.percentile(planet_only_anomaly,99),np.percentile(residual_anomaly,99))
 vmin = max(np.percentile(planet_only_anomaly,1),np.percentile(residual_anomaly,1))
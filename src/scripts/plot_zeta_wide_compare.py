@@ -8,6 +8,7 @@ import matplotlib.pyplot as plt
 import paths
 import colors
 import read
+import anomalies
 import spirals
 from plot_sound_speed import get_sound_speed
 
@@ -25,12 +26,8 @@ r_mid = r[:-1] + np.diff(r)/2
 logr = np.log10(r)
 lnr_mid = np.log(r_mid)
 
-initial_density = read.get_data(0, 'none', True, 'rho').T
-planet_only_density = read.get_data(INDEX, 'none', True, 'rho').T
-shadow_only_density = read.get_data(INDEX, SHADOW, False, 'rho').T
-both_density = read.get_data(INDEX, SHADOW, True, 'rho').T
-residual_anomaly = (both_density - shadow_only_density) / initial_density * 100
-planet_only_anomaly = (planet_only_density - initial_density) / initial_density * 100
+residual_anomaly = anomalies.residual(INDEX, SHADOW).T
+planet_only_anomaly = anomalies.anomaly(INDEX, 'none', True).T
 
 phi_peak = spirals.find_peaks(r,phi,residual_anomaly, PHI_PLANET, WIDTH)
 _logr_mid, _phi_peak = spirals.reconstruct(lnr_mid,phi_peak)
@@ -2,19 +2,70 @@
 Read from the data archive
 """
 
+import os
+import io
+import json
+import time
+import shutil
+import atexit
+import tempfile
+import warnings
 import h5py
-from typing import Tuple
+from typing import Tuple, Dict, List
 import tarfile
 from pathlib import Path
 from contextlib import contextmanager
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 
 import paths
+import archive
+import instrument
 
-DATA_PATH = paths.data
+# The data directory, which can be moved with an environment variable
+DATA_PATH = Path(os.environ.get('SHADOW_SPIRALS_DATA', paths.data))
 IMIN = 0
 IMAX = 600
 
+# The (shadow, planet) arguments that identify each case
+CASES = {
+    'no_shadow': ('none', True),
+    'narrow_with': ('narrow', True),
+    'narrow_without': ('narrow', False),
+    'wide_with': ('wide', True),
+    'wide_without': ('wide', False)
+}
+
+# Written into a case directory once its archive is fully extracted
+EXTRACTED_MARKER = '.extracted'
+
+# Open file handles are kept in a bounded LRU pool keyed by (case, index)
+POOL_SIZE = 32
+# HDF5 raw data chunk cache, applied to every file opened by the pool
+CHUNK_CACHE_NBYTES = 16 * 1024**2
+CHUNK_CACHE_NSLOTS = 521
+CHUNK_CACHE_W0 = 0.75
+
+# Index of each primitive variable along the first axis of ``prim``
+VARIABLES = {
+    'rho': 0,
+    'press': 1,
+    'velr': 2,
+    'velphi': 3,
+    'velz': 4
+}
+# Derived variables, as (primitives needed, function of those primitives)
+DERIVED = {
+    'temp': (('press', 'rho'), lambda press, rho: np.divide(press, rho, out=press))
+}
+
+_pool:'OrderedDict[Tuple[str,int],h5py.File]' = OrderedDict()
+# The number of open ``read`` blocks using each handle, by id
+_borrowed:Dict[int,int] = {}
+# Handles dropped from the pool while borrowed, closed once returned
+_retired:Dict[int,h5py.File] = {}
+
 def get_case_name(shadow:str, planet:bool)->str:
     """
     Get the string used to identify the case
@@ -97,31 +148,267 @@ def get_path(index:int,shadow:str, planet:bool)->Path:
     """
     return get_case_path(shadow, planet) / get_filename(index, shadow, planet)
 
+def has_snapshot(index:int,shadow:str, planet:bool)->bool:
+    """
+    Check if a snapshot is available, extracted or in the archive.
+    """
+    if get_path(index, shadow, planet).exists():
+        return True
+    tar_path = get_case_tar_path(shadow, planet)
+    if not tar_path.exists():
+        return False
+    return get_filename(index, shadow, planet) in archive.get_index(tar_path).members
+
+def get_stop(shadow:str, planet:bool, start:int=IMIN, stop:int=IMAX+1)->int:
+    """
+    Find the first missing snapshot.
+    
+    Parameters
+    ----------
+    shadow : str
+        'none', 'narrow', or 'wide'
+    planet : bool
+        True if the planet is present
+    start : int, optional
+        The first snapshot index to check
+    stop : int, optional
+        One past the last snapshot index to check
+    
+    Returns
+    -------
+    int
+        The index of the first missing snapshot, or ``stop`` if none are missing
+    """
+    return next((i for i in range(start, stop) if not has_snapshot(i, shadow, planet)), stop)
+
+def is_extracted(shadow:str, planet:bool)->bool:
+    """
+    Check if the archive for this case has been fully extracted.
+    """
+    return (get_case_path(shadow, planet) / EXTRACTED_MARKER).exists()
+
+@instrument.timed
 def untar(shadow:str, planet:bool):
     """
     Untar the data
+    
+    The archive is extracted into a temporary directory and renamed into
+    place once complete. A lock file next to the case directory makes
+    concurrent calls for the same case wait for the first extraction
+    rather than repeat it.
     """
+    # POSIX only, and only needed here, so importing read stays portable
+    import fcntl
     tar_path = get_case_tar_path(shadow, planet)
-    with tarfile.open(tar_path,mode='r:gz') as tar:
-        tar.extractall(get_case_path(shadow, planet),filter='data')
+    case_path = get_case_path(shadow, planet)
+    lock_path = case_path.with_name(f'{case_path.name}.lock')
+    with open(lock_path, 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if is_extracted(shadow, planet):
+                return
+            start = time.perf_counter()
+            tmp_path = Path(tempfile.mkdtemp(prefix=f'.{case_path.name}.', dir=case_path.parent))
+            old_path = tmp_path.with_name(f'{tmp_path.name}.old')
+            try:
+                with tarfile.open(tar_path,mode='r:gz') as tar:
+                    tar.extractall(tmp_path,filter='data')
+                (tmp_path / EXTRACTED_MARKER).touch()
+                # an incomplete extraction may already be in the way
+                if case_path.exists():
+                    os.rename(case_path, old_path)
+                os.rename(tmp_path, case_path)
+            finally:
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                shutil.rmtree(old_path, ignore_errors=True)
+            instrument.count('untar_seconds', case_path.name, time.perf_counter() - start)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+def _untar_case(case:str)->Path:
+    """
+    Untar a case by name, for use in a process pool.
+    """
+    shadow, planet = CASES[case]
+    untar(shadow, planet)
+    return get_case_path(shadow, planet)
+
+@instrument.timed
+def prepare(cases:List[str]=None, jobs:int=None)->List[Path]:
+    """
+    Extract the archives of several cases concurrently.
+    
+    Parameters
+    ----------
+    cases : list of str, optional
+        The names of the cases to extract. Defaults to all of them.
+    jobs : int, optional
+        The number of worker processes. Defaults to one per case.
+    
+    Returns
+    -------
+    list of Path
+        The extracted case directories
+    """
+    cases = list(CASES) if cases is None else list(cases)
+    for case in cases:
+        if case not in CASES:
+            raise ValueError(f'Unknown case: {case}')
+    todo = [case for case in cases if not is_extracted(*CASES[case])]
+    if todo:
+        with ProcessPoolExecutor(max_workers=jobs or len(todo)) as executor:
+            list(executor.map(_untar_case, todo))
+    return [get_case_path(*CASES[case]) for case in cases]
+
+def configure_pool(
+    size:int=None,
+    chunk_cache_nbytes:int=None,
+    chunk_cache_nslots:int=None,
+    chunk_cache_w0:float=None
+):
+    """
+    Configure the pool of open file handles.
+    
+    Parameters
+    ----------
+    size : int, optional
+        The maximum number of files to keep open.
+    chunk_cache_nbytes : int, optional
+        The size of the raw data chunk cache of each file, in bytes.
+    chunk_cache_nslots : int, optional
+        The number of slots in the chunk cache hash table.
+    chunk_cache_w0 : float, optional
+        The chunk preemption policy, between 0 and 1.
+    
+    Notes
+    -----
+    Changing the chunk cache settings closes all pooled files, as the
+    cache can only be set when a file is opened.
+    """
+    global POOL_SIZE, CHUNK_CACHE_NBYTES, CHUNK_CACHE_NSLOTS, CHUNK_CACHE_W0
+    if size is not None:
+        if size < 1:
+            raise ValueError(f'Pool size must be positive: {size}')
+        POOL_SIZE = size
+    cache = (chunk_cache_nbytes, chunk_cache_nslots, chunk_cache_w0)
+    if any(c is not None for c in cache):
+        close_all()
+    if chunk_cache_nbytes is not None:
+        CHUNK_CACHE_NBYTES = chunk_cache_nbytes
+    if chunk_cache_nslots is not None:
+        CHUNK_CACHE_NSLOTS = chunk_cache_nslots
+    if chunk_cache_w0 is not None:
+        CHUNK_CACHE_W0 = chunk_cache_w0
+    _evict()
+
+def _close(f:h5py.File):
+    """
+    Close a handle dropped from the pool, or once it is no longer borrowed.
+    """
+    if id(f) in _borrowed:
+        _retired[id(f)] = f
+    else:
+        f.close()
+
+def _release(f:h5py.File):
+    """
+    Return a handle borrowed with ``_open``.
+    """
+    _borrowed[id(f)] -= 1
+    if not _borrowed[id(f)]:
+        del _borrowed[id(f)]
+        retired = _retired.pop(id(f), None)
+        if retired is not None:
+            retired.close()
+
+def _evict():
+    """
+    Drop the least recently used files until the pool fits.
+    
+    Files still in use by a ``read`` block are closed when it exits.
+    """
+    while len(_pool) > POOL_SIZE:
+        _, f = _pool.popitem(last=False)
+        _close(f)
+
+def close_all():
+    """
+    Close every pooled file handle.
+    
+    Files still in use by a ``read`` block are closed when it exits.
+    """
+    while _pool:
+        _, f = _pool.popitem()
+        _close(f)
+
+def _forget_pool():
+    _pool.clear()
+    _borrowed.clear()
+    _retired.clear()
+
+atexit.register(close_all)
+# h5py handles must not be shared with forked workers
+os.register_at_fork(after_in_child=_forget_pool)
+
+@instrument.timed
+def _open(index:int,shadow:str, planet:bool)->h5py.File:
+    """
+    Borrow an open, read-only handle from the pool.
+    
+    The handle is not closed until it is returned with ``_release``.
+    """
+    name = get_case_name(shadow, planet)
+    key = (name, index)
+    f = _pool.get(key)
+    if f is not None and f.id.valid:
+        _pool.move_to_end(key)
+        _borrowed[id(f)] = _borrowed.get(id(f), 0) + 1
+        return f
+    path = get_path(index,shadow, planet)
+    if not path.exists():
+        tar_path = get_case_tar_path(shadow, planet)
+        if archive.get_index(tar_path).seekable:
+            # serve the snapshot straight from the archive, in memory
+            data = archive.read_member(tar_path, path.name)
+            instrument.count('archive_bytes', name, len(data))
+            path = io.BytesIO(data)
+        else:
+            # without saved access points every process would inflate
+            # the archive from the start, so extract it once instead
+            untar(shadow, planet)
+    instrument.count('opens', name)
+    f = h5py.File(
+        path, 'r',
+        rdcc_nbytes=CHUNK_CACHE_NBYTES,
+        rdcc_nslots=CHUNK_CACHE_NSLOTS,
+        rdcc_w0=CHUNK_CACHE_W0
+    )
+    _pool[key] = f
+    _borrowed[id(f)] = 1
+    _evict()
+    return f
 
 @contextmanager
 def read(index:int,shadow:str, planet:bool):
     """
     Read the data
+    
+    The file handle is borrowed from a pool of open files and stays
+    open after the block exits. Use ``close_all`` to release it. A
+    handle is never closed while a block is still using it.
+    Snapshots that have not been extracted are decompressed from the
+    case archive into memory, or the whole archive is extracted if no
+    access points could be saved for it.
     """
     if index < IMIN or index > IMAX:
         raise ValueError(f'Index out of range: {index}')
-    path = get_path(index,shadow, planet)
-    if not path.exists():
-        print(f'Missing {path}, untaring...')
-        untar(shadow, planet)
-    f = h5py.File(path, 'r')
+    f = _open(index, shadow, planet)
     try:
         yield f
     finally:
-        f.close()
+        _release(f)
 
+@instrument.timed
 def get_coords(index:int,shadow:str, planet:bool)->Tuple[np.ndarray, np.ndarray]:
     """
     Get the coordinates
@@ -142,19 +429,196 @@ def get_coords(index:int,shadow:str, planet:bool)->Tuple[np.ndarray, np.ndarray]
     phi : np.ndarray
         The azimuthal coordinates
     """
+    cube = open_cube(shadow, planet)
+    if cube is not None and index in cube:
+        return cube.x1f.copy(), cube.x2f.copy()
     with read(index, shadow, planet) as f:
         r = f['x1f'][0]
         phi = f['x2f'][0]
         return r,phi
 
-def _get_dat(index:int,shadow:str, planet:bool,var_index:int)->np.ndarray:
+def get_index_range(edges:np.ndarray, bounds:Tuple[float,float]=None, step:int=1)->slice:
+    """
+    Find the cells that overlap a coordinate range.
+    
+    Parameters
+    ----------
+    edges : np.ndarray
+        The cell edges
+    bounds : tuple, optional
+        The (lower, upper) coordinates. Defaults to every cell.
+    step : int, optional
+        Keep only every ``step``-th cell
+    
+    Returns
+    -------
+    slice
+        The indices of the cells
     """
-    Generic getter for the data
+    if step < 1:
+        raise ValueError(f'Step must be positive: {step}')
+    ncell = len(edges) - 1
+    if bounds is None:
+        return slice(0, ncell, step)
+    lower, upper = bounds
+    if lower > upper:
+        raise ValueError(f'Bounds out of order: {bounds}')
+    if upper < edges[0] or lower > edges[-1]:
+        raise ValueError(f'Bounds {bounds} outside the grid ({edges[0]}, {edges[-1]})')
+    start = max(int(np.searchsorted(edges, lower, side='right')) - 1, 0)
+    stop = min(int(np.searchsorted(edges, upper, side='left')), ncell)
+    return slice(start, max(stop, start + 1), step)
+
+def get_edges(edges:np.ndarray, selection:slice)->np.ndarray:
     """
-    with read(index, shadow, planet) as f:
-        return f['prim'][var_index,0,0,:,:]
+    Get the edges of a selection of cells.
+    
+    With a step, each kept cell stands in for the ``step`` cells that
+    follow it, so the edges still span the whole selection.
+    
+    Parameters
+    ----------
+    edges : np.ndarray
+        The cell edges
+    selection : slice
+        The indices of the cells, as from ``get_index_range``
+    
+    Returns
+    -------
+    np.ndarray
+        The edges of the selected cells
+    """
+    start, stop, step = selection.indices(len(edges) - 1)
+    n = len(range(start, stop, step))
+    return edges[np.minimum(start + np.arange(n + 1)*step, stop)]
+
+def _get_selection(
+    index:int,
+    shadow:str,
+    planet:bool,
+    r_range:Tuple[float,float]=None,
+    phi_range:Tuple[float,float]=None,
+    r_step:int=1,
+    phi_step:int=1
+)->Tuple[slice,slice]:
+    """
+    Resolve physical bounds to index ranges, reading the coordinates only if needed.
+    """
+    if r_range is None and phi_range is None:
+        for step in (r_step, phi_step):
+            if step < 1:
+                raise ValueError(f'Step must be positive: {step}')
+        return slice(None, None, r_step), slice(None, None, phi_step)
+    r, phi = get_coords(index, shadow, planet)
+    return get_index_range(r, r_range, r_step), get_index_range(phi, phi_range, phi_step)
+
+def _get_planes(
+    index:int,
+    shadow:str,
+    planet:bool,
+    var_indices:List[int],
+    r_sel:slice=slice(None),
+    phi_sel:slice=slice(None)
+)->List[np.ndarray]:
+    """
+    Read several planes of ``prim`` with a single selection.
+    
+    Planes come from the packed cube as read-only views when it exists,
+    so callers that hand them out must copy them first.
+    Only the hyperslab selected by ``phi_sel`` and ``r_sel`` is read.
+    """
+    if index < IMIN or index > IMAX:
+        raise ValueError(f'Index out of range: {index}')
+    cube = open_cube(shadow, planet)
+    if cube is not None and index in cube:
+        planes = [cube.snapshot(index, i)[phi_sel, r_sel] for i in var_indices]
+    else:
+        with read(index, shadow, planet) as f:
+            planes = f['prim'][var_indices,0,0,phi_sel,r_sel]
+    if instrument.ENABLED:
+        instrument.count('bytes_read', get_case_name(shadow, planet), sum(plane.nbytes for plane in planes))
+    return planes
+
+@instrument.timed
+def get_fields(
+    index:int,
+    shadow:str,
+    planet:bool,
+    var_names:List[str],
+    r_range:Tuple[float,float]=None,
+    phi_range:Tuple[float,float]=None,
+    r_step:int=1,
+    phi_step:int=1
+)->Dict[str,np.ndarray]:
+    """
+    Get several 2D datasets from one snapshot, reading the file once.
+    
+    Parameters
+    ----------
+    index : int
+        The index of the snapshot to read
+    shadow : str
+        'none', 'narrow', or 'wide'
+    planet : bool
+        True if the planet is present
+    var_names : list of str
+        The names of the variables to read. Derived variables
+        (e.g. 'temp') are computed from the primitives in memory.
+    r_range : tuple, optional
+        Only read the cells overlapping these (lower, upper) radii
+    phi_range : tuple, optional
+        Only read the cells overlapping these (lower, upper) angles
+    r_step : int, optional
+        Only read every ``r_step``-th radial cell
+    phi_step : int, optional
+        Only read every ``phi_step``-th azimuthal cell
+    
+    Returns
+    -------
+    dict
+        The data (nphi, nrad) for each variable name
+    """
+    # count the uses of each primitive so unshared buffers can be overwritten
+    uses = {}
+    for var_name in var_names:
+        if var_name in DERIVED:
+            deps = DERIVED[var_name][0]
+        elif var_name in VARIABLES:
+            deps = (var_name,)
+        else:
+            raise ValueError(f'Unknown variable: {var_name}')
+        for dep in deps:
+            uses[dep] = uses.get(dep, 0) + 1
+    primitives = sorted(uses, key=VARIABLES.get)
+    r_sel, phi_sel = _get_selection(index, shadow, planet, r_range, phi_range, r_step, phi_step)
+    planes = _get_planes(index,shadow,planet,[VARIABLES[name] for name in primitives],r_sel,phi_sel)
+    buffers = dict(zip(primitives, planes))
+    fields = {}
+    for var_name in var_names:
+        if var_name in DERIVED:
+            deps, func = DERIVED[var_name]
+            first = buffers[deps[0]]
+            if uses[deps[0]] > 1 or not first.flags.writeable:
+                first = np.array(first)
+            uses[deps[0]] -= 1
+            fields[var_name] = func(first, *(buffers[dep] for dep in deps[1:]))
+        else:
+            # planes of the cube are read-only views of the memory map
+            plane = buffers[var_name]
+            fields[var_name] = plane if plane.flags.writeable else np.array(plane)
+    return fields
 
-def get_data(index:int,shadow:str, planet:bool, var_name:str)->np.ndarray:
+@instrument.timed
+def get_data(
+    index:int,
+    shadow:str,
+    planet:bool,
+    var_name:str,
+    r_range:Tuple[float,float]=None,
+    phi_range:Tuple[float,float]=None,
+    r_step:int=1,
+    phi_step:int=1
+)->np.ndarray:
     """
     Get a 2D dataset from the Athena++ output.
     
@@ -168,19 +632,547 @@ def get_data(index:int,shadow:str, planet:bool, var_name:str)->np.ndarray:
         True if the planet is present
     var_name : str
         The name of the variable to read
+    r_range : tuple, optional
+        Only read the cells overlapping these (lower, upper) radii
+    phi_range : tuple, optional
+        Only read the cells overlapping these (lower, upper) angles
+    r_step : int, optional
+        Only read every ``r_step``-th radial cell
+    phi_step : int, optional
+        Only read every ``phi_step``-th azimuthal cell
     
     Returns
     -------
     np.ndarray
         The data (nrad, nphi)
     """
-    mapper = {
-        'rho': 0,
-        'press': 1,
-        'velr': 2,
-        'velphi': 3,
-        'velz': 4
+    return get_fields(index,shadow,planet,[var_name],r_range,phi_range,r_step,phi_step)[var_name]
+
+@instrument.timed
+def get_region(
+    index:int,
+    shadow:str,
+    planet:bool,
+    var_name:str,
+    r_range:Tuple[float,float]=None,
+    phi_range:Tuple[float,float]=None,
+    r_step:int=1,
+    phi_step:int=1
+)->Tuple[np.ndarray,np.ndarray,np.ndarray]:
+    """
+    Read part of a 2D dataset, along with the edges of its cells.
+    
+    Parameters
+    ----------
+    index : int
+        The index of the snapshot to read
+    shadow : str
+        'none', 'narrow', or 'wide'
+    planet : bool
+        True if the planet is present
+    var_name : str
+        The name of the variable to read
+    r_range : tuple, optional
+        Only read the cells overlapping these (lower, upper) radii
+    phi_range : tuple, optional
+        Only read the cells overlapping these (lower, upper) angles
+    r_step : int, optional
+        Only read every ``r_step``-th radial cell
+    phi_step : int, optional
+        Only read every ``phi_step``-th azimuthal cell
+    
+    Returns
+    -------
+    r : np.ndarray
+        The radial edges of the cells read
+    phi : np.ndarray
+        The azimuthal edges of the cells read
+    data : np.ndarray
+        The data, with one cell fewer than edges along each axis
+    """
+    r, phi = get_coords(index, shadow, planet)
+    r_sel = get_index_range(r, r_range, r_step)
+    phi_sel = get_index_range(phi, phi_range, phi_step)
+    data = get_data(index, shadow, planet, var_name, r_range, phi_range, r_step, phi_step)
+    return get_edges(r, r_sel), get_edges(phi, phi_sel), data
+
+# Consolidated cube store: a JSON header followed by the raw
+# (nvar, nt, nphi, nrad) array, aligned so it can be memory mapped
+CUBE_MAGIC = b'SPCUBE01'
+CUBE_ALIGN = 4096
+
+# cube path -> ((cube mtime, archive size and mtime), cube)
+_cubes:Dict[Path,Tuple[tuple,'Cube']] = {}
+
+def get_cube_path(shadow:str, planet:bool)->Path:
+    """
+    Get the path to the consolidated cube file for this case
+    
+    Parameters
+    ----------
+    shadow : str
+        'none', 'narrow', or 'wide'
+    planet : bool
+        True if the planet is present
+        
+    Returns
+    -------
+    Path
+        The path to the cube file
+    """
+    name = get_case_name(shadow, planet)
+    return DATA_PATH / f'{name}.cube'
+
+class Cube:
+    """
+    A memory mapped, read-only view of a packed case.
+    
+    Attributes
+    ----------
+    data : np.memmap
+        The primitives, with shape (nvar, nt, nphi, nrad)
+    start : int
+        The snapshot index of the first time step
+    x1f : np.ndarray
+        The radial coordinates
+    x2f : np.ndarray
+        The azimuthal coordinates
+    source : list or None
+        The [size, mtime_ns] of the data it was packed from
+    """
+    def __init__(self, path:Path):
+        with open(path, 'rb') as f:
+            magic = f.read(len(CUBE_MAGIC))
+            if magic != CUBE_MAGIC:
+                raise ValueError(f'Not a cube file: {path}')
+            length = int.from_bytes(f.read(8), 'little')
+            self.header = json.loads(f.read(length))
+        offset = self.header['offset']
+        self.data = np.memmap(
+            path, dtype=np.dtype(self.header['dtype']), mode='r',
+            offset=offset, shape=tuple(self.header['shape'])
+        )
+        self.start = self.header['start']
+        coord_dtype = np.dtype(self.header['coord_dtype'])
+        self.x1f = np.array(self.header['x1f'], dtype=coord_dtype)
+        self.x2f = np.array(self.header['x2f'], dtype=coord_dtype)
+        self.source = self.header.get('source')
+    
+    @property
+    def stop(self)->int:
+        return self.start + self.data.shape[1]
+    
+    def __contains__(self, index:int)->bool:
+        return self.start <= index < self.stop
+    
+    def snapshot(self, index:int, var_index:int)->np.ndarray:
+        """
+        Get a zero-copy (nphi, nrad) view of one variable at one time.
+        """
+        return self.data[var_index, index - self.start]
+
+def _get_source(shadow:str, planet:bool, start:int, stop:int)->'List[int] | None':
+    """
+    Get the [size, mtime_ns] of the data a cube is packed from.
+    
+    This is the archive if there is one, and otherwise the total size
+    and latest modification of the extracted snapshots. None if neither
+    exists, in which case the cube is the only copy of the data.
+    """
+    tar_path = get_case_tar_path(shadow, planet)
+    try:
+        stat = tar_path.stat()
+        return [stat.st_size, stat.st_mtime_ns]
+    except FileNotFoundError:
+        pass
+    stats = []
+    for index in range(start, stop):
+        try:
+            stats.append(get_path(index, shadow, planet).stat())
+        except FileNotFoundError:
+            continue
+    if not stats:
+        return None
+    return [sum(stat.st_size for stat in stats), max(stat.st_mtime_ns for stat in stats)]
+
+def open_cube(shadow:str, planet:bool)->'Cube | None':
+    """
+    Open the consolidated cube for a case, if it has been packed.
+    
+    A cube whose archive or snapshots have changed since it was packed
+    is packed again first.
+    
+    Parameters
+    ----------
+    shadow : str
+        'none', 'narrow', or 'wide'
+    planet : bool
+        True if the planet is present
+    
+    Returns
+    -------
+    Cube or None
+        The memory mapped cube, or None if it does not exist
+    """
+    path = get_cube_path(shadow, planet)
+    try:
+        mtime = path.stat().st_mtime_ns
+    except FileNotFoundError:
+        _cubes.pop(path, None)
+        return None
+    # a replaced archive is noticed without reopening the cube
+    try:
+        stat = get_case_tar_path(shadow, planet).stat()
+        stamp = (mtime, stat.st_size, stat.st_mtime_ns)
+    except FileNotFoundError:
+        stamp = (mtime,)
+    cached = _cubes.get(path)
+    if cached is None or cached[0] != stamp:
+        cube = Cube(path)
+        source = _get_source(shadow, planet, cube.start, cube.stop)
+        if source is not None and source != cube.source:
+            warnings.warn(f'{path} no longer matches the data it was packed from, packing it again')
+            _cubes.pop(path, None)
+            pack(shadow, planet, cube.start)
+            return open_cube(shadow, planet)
+        cached = (stamp, cube)
+        _cubes[path] = cached
+    return cached[1]
+
+@instrument.timed
+def pack(shadow:str, planet:bool, start:int=IMIN, stop:int=IMAX+1)->Path:
+    """
+    Pack the snapshots of a case into a single cube file.
+    
+    Snapshots are read in order from ``start`` until ``stop`` or the
+    first missing snapshot. The cube is written next to the archive and
+    moved into place only once it is complete.
+    
+    Parameters
+    ----------
+    shadow : str
+        'none', 'narrow', or 'wide'
+    planet : bool
+        True if the planet is present
+    start : int, optional
+        The first snapshot index
+    stop : int, optional
+        One past the last snapshot index to pack
+    
+    Returns
+    -------
+    Path
+        The path to the cube file
+    """
+    with read(start, shadow, planet) as f:
+        shape = f['prim'].shape
+        dtype = f['prim'].dtype
+        x1f = f['x1f'][0]
+        x2f = f['x2f'][0]
+    stop = get_stop(shadow, planet, start, stop)
+    source = _get_source(shadow, planet, start, stop)
+    nvar, _, _, nphi, nrad = shape
+    header = {
+        'case': get_case_name(shadow, planet),
+        'variables': sorted(VARIABLES, key=VARIABLES.get),
+        'dtype': dtype.str,
+        'shape': [nvar, stop - start, nphi, nrad],
+        'start': start,
+        'coord_dtype': x1f.dtype.str,
+        'x1f': x1f.tolist(),
+        'x2f': x2f.tolist(),
+        'source': source,
+        'offset': 0
     }
-    if var_name == 'temp':
-        return _get_dat(index,shadow,planet,mapper['press']) /_get_dat(index,shadow,planet,mapper['rho'])
-    return _get_dat(index,shadow,planet,mapper[var_name])
\ No newline at end of file
+    # the offset is part of the header, so size it with a placeholder first
+    length = len(json.dumps(header).encode()) + 32
+    offset = -(-(len(CUBE_MAGIC) + 8 + length) // CUBE_ALIGN) * CUBE_ALIGN
+    header['offset'] = offset
+    encoded = json.dumps(header).encode().ljust(length)
+
+    path = get_cube_path(shadow, planet)
+    tmp_path = path.with_suffix(f'.cube.{os.getpid()}.tmp')
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(CUBE_MAGIC)
+            f.write(length.to_bytes(8, 'little'))
+            f.write(encoded)
+            f.truncate(offset + dtype.itemsize * nvar * (stop - start) * nphi * nrad)
+        cube = np.memmap(tmp_path, dtype=dtype, mode='r+', offset=offset, shape=tuple(header['shape']))
+        buffer = np.empty((nvar, nphi, nrad), dtype=dtype)
+        for k, index in enumerate(range(start, stop)):
+            with read(index, shadow, planet) as f:
+                f['prim'].read_direct(buffer, np.s_[:,0,0,:,:])
+            cube[:, k] = buffer
+        cube.flush()
+        del cube
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    return path
+
+class Series:
+    """
+    A lazy array of one variable over the snapshots of a case.
+    
+    The array has shape (nt, nrad, nphi). Indexing it reads only the
+    snapshots and hyperslabs that the index touches, directly into a
+    single preallocated output buffer. If the case has been packed with
+    ``pack``, the selection is taken from the memory mapped cube instead.
+    
+    Parameters
+    ----------
+    shadow : str
+        'none', 'narrow', or 'wide'
+    planet : bool
+        True if the planet is present
+    var_name : str
+        The name of the variable to read
+    start : int, optional
+        The first snapshot index
+    stop : int, optional
+        One past the last snapshot index. Defaults to the first missing
+        snapshot.
+    """
+    def __init__(self,shadow:str, planet:bool, var_name:str, start:int=IMIN, stop:int=None):
+        if var_name in DERIVED:
+            self._deps = DERIVED[var_name][0]
+        elif var_name in VARIABLES:
+            self._deps = (var_name,)
+        else:
+            raise ValueError(f'Unknown variable: {var_name}')
+        self.shadow = shadow
+        self.planet = planet
+        self.var_name = var_name
+        if stop is None:
+            stop = get_stop(shadow, planet, start)
+        self.indices = np.arange(start, stop)
+        cube = open_cube(shadow, planet)
+        if cube is not None and start in cube:
+            _, _, nphi, nrad = cube.data.shape
+            self.dtype = cube.data.dtype
+        else:
+            with read(start, shadow, planet) as f:
+                _, _, _, nphi, nrad = f['prim'].shape
+                self.dtype = f['prim'].dtype
+        self.shape = (len(self.indices), nrad, nphi)
+    
+    @property
+    def ndim(self)->int:
+        return 3
+    
+    def __len__(self)->int:
+        return self.shape[0]
+    
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self[:], dtype=dtype)
+    
+    def __repr__(self)->str:
+        name = get_case_name(self.shadow, self.planet)
+        return f'Series({name!r}, {self.var_name!r}, shape={self.shape})'
+    
+    @staticmethod
+    def _spatial(key, n:int)->Tuple[slice,bool]:
+        """
+        Convert an index along r or phi to a positive-step slice.
+        """
+        if isinstance(key, slice):
+            start, stop, step = key.indices(n)
+            if step < 0:
+                raise IndexError('Negative steps are only supported along time')
+            return slice(start, max(start, stop), step), False
+        i = int(key)
+        if i < -n or i >= n:
+            raise IndexError(f'Index {i} out of range for axis of size {n}')
+        i = i % n
+        return slice(i, i+1, 1), True
+    
+    @instrument.timed
+    def __getitem__(self, key)->np.ndarray:
+        if not isinstance(key, tuple):
+            key = (key,)
+        if any(k is Ellipsis for k in key):
+            i = key.index(Ellipsis)
+            key = key[:i] + (slice(None),)*(4 - len(key)) + key[i+1:]
+        if len(key) > 3:
+            raise IndexError(f'Too many indices: {len(key)}')
+        key = key + (slice(None),)*(3 - len(key))
+        t_key, r_key, phi_key = key
+        indices = self.indices[t_key]
+        t_scalar = np.ndim(indices) == 0
+        indices = np.atleast_1d(indices)
+        r_sel, r_scalar = self._spatial(r_key, self.shape[1])
+        phi_sel, phi_scalar = self._spatial(phi_key, self.shape[2])
+        cube = open_cube(self.shadow, self.planet)
+        if cube is not None and len(indices) and indices.min() in cube and indices.max() in cube:
+            out = self._from_cube(cube, indices - cube.start, phi_sel, r_sel)
+        else:
+            out = self._from_snapshots(indices, phi_sel, r_sel)
+        out = np.swapaxes(out, 1, 2)
+        return out[
+            0 if t_scalar else slice(None),
+            0 if r_scalar else slice(None),
+            0 if phi_scalar else slice(None)
+        ]
+    
+    def _from_cube(self, cube:Cube, positions:np.ndarray, phi_sel:slice, r_sel:slice)->np.ndarray:
+        """
+        Select from the memory mapped cube, without copying if possible.
+        """
+        steps = np.diff(positions)
+        if len(positions) == 1 or (steps[0] > 0 and np.all(steps == steps[0])):
+            step = steps[0] if len(steps) else 1
+            t_sel = slice(positions[0], positions[-1] + 1, step)
+        else:
+            t_sel = positions
+        planes = [cube.data[VARIABLES[dep]][:, phi_sel, r_sel][t_sel] for dep in self._deps]
+        if instrument.ENABLED:
+            instrument.count('bytes_read', get_case_name(self.shadow, self.planet), sum(plane.nbytes for plane in planes))
+        if len(planes) == 1:
+            return planes[0]
+        return DERIVED[self.var_name][1](np.array(planes[0]), *planes[1:])
+    
+    def _from_snapshots(self, indices:np.ndarray, phi_sel:slice, r_sel:slice)->np.ndarray:
+        """
+        Read each snapshot file into one preallocated buffer.
+        """
+        nrad = len(range(r_sel.start, r_sel.stop, r_sel.step))
+        nphi = len(range(phi_sel.start, phi_sel.stop, phi_sel.step))
+        # fill in the on-disk (phi, r) order and transpose at the end
+        out = np.empty((len(indices), nphi, nrad), dtype=self.dtype)
+        scratch = [np.empty((nphi, nrad), dtype=self.dtype) for _ in self._deps[1:]]
+        for k, index in enumerate(indices if out.size else []):
+            with read(int(index), self.shadow, self.planet) as f:
+                prim = f['prim']
+                for dest, dep in zip([out[k]] + scratch, self._deps):
+                    prim.read_direct(dest, np.s_[VARIABLES[dep],0,0,phi_sel,r_sel])
+            if scratch:
+                DERIVED[self.var_name][1](out[k], *scratch)
+        if instrument.ENABLED:
+            instrument.count('bytes_read', get_case_name(self.shadow, self.planet), out.nbytes*len(self._deps))
+        return out
+
+def open_series(shadow:str, planet:bool, var_name:str, start:int=IMIN, stop:int=None)->Series:
+    """
+    Open a lazy time series of a variable.
+    
+    Parameters
+    ----------
+    shadow : str
+        'none', 'narrow', or 'wide'
+    planet : bool
+        True if the planet is present
+    var_name : str
+        The name of the variable to read
+    start : int, optional
+        The first snapshot index
+    stop : int, optional
+        One past the last snapshot index. Defaults to the first missing
+        snapshot.
+    
+    Returns
+    -------
+    Series
+        An array-like of shape (nt, nrad, nphi)
+    """
+    return Series(shadow, planet, var_name, start, stop)
+
+@instrument.timed
+def get_radial_profile(
+    shadow:str,
+    planet:bool,
+    var_name:str,
+    i_phi:int,
+    start:int=IMIN,
+    stop:int=None,
+    step:int=1
+)->np.ndarray:
+    """
+    Get a space-time diagram of a variable along r, at a fixed phi.
+    
+    Only the row at ``i_phi`` is read from each snapshot.
+    
+    Parameters
+    ----------
+    shadow : str
+        'none', 'narrow', or 'wide'
+    planet : bool
+        True if the planet is present
+    var_name : str
+        The name of the variable to read
+    i_phi : int
+        The index of the phi cell
+    start : int, optional
+        The first snapshot index
+    stop : int, optional
+        One past the last snapshot index. Defaults to the first missing
+        snapshot.
+    step : int, optional
+        The spacing between snapshots
+    
+    Returns
+    -------
+    np.ndarray
+        The profile (nt, nrad)
+    """
+    return open_series(shadow, planet, var_name, start, stop)[::step, :, i_phi]
+
+@instrument.timed
+def get_azimuthal_profile(
+    shadow:str,
+    planet:bool,
+    var_name:str,
+    i_r:int,
+    start:int=IMIN,
+    stop:int=None,
+    step:int=1
+)->np.ndarray:
+    """
+    Get a space-time diagram of a variable along phi, at a fixed r.
+    
+    Only the column at ``i_r`` is read from each snapshot.
+    
+    Parameters
+    ----------
+    shadow : str
+        'none', 'narrow', or 'wide'
+    planet : bool
+        True if the planet is present
+    var_name : str
+        The name of the variable to read
+    i_r : int
+        The index of the radial cell
+    start : int, optional
+        The first snapshot index
+    stop : int, optional
+        One past the last snapshot index. Defaults to the first missing
+        snapshot.
+    step : int, optional
+        The spacing between snapshots
+    
+    Returns
+    -------
+    np.ndarray
+        The profile (nt, nphi)
+    """
+    return open_series(shadow, planet, var_name, start, stop)[::step, i_r, :]
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Prepare the data archives.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    prepare_parser = subparsers.add_parser('prepare', help='Extract case archives concurrently')
+    prepare_parser.add_argument('cases', nargs='*', help=f'The cases to extract, out of {", ".join(CASES)}. Defaults to all of them.')
+    prepare_parser.add_argument('-j', '--jobs', type=int, default=None, help='The number of worker processes')
+    pack_parser = subparsers.add_parser('pack', help='Pack cases into consolidated cube files')
+    pack_parser.add_argument('cases', nargs='+', choices=list(CASES), help='The cases to pack')
+    args = parser.parse_args()
+    if args.command == 'prepare':
+        unknown = sorted(set(args.cases) - set(CASES))
+        if unknown:
+            prepare_parser.error(f'Unknown cases: {", ".join(unknown)}')
+        for path in prepare(args.cases or None, args.jobs):
+            print(f'Extracted {path}')
+    else:
+        for case in args.cases:
+            print(f'Packed {pack(*CASES[case])}')
@@ -1,14 +1,27 @@
 """
 Functions to find spirals
 """
-from typing import Tuple
+from typing import Tuple, List
+from collections import OrderedDict
+import math
+import inspect
+import hashlib
+import functools
 import numpy as np
-from scipy.integrate import simpson
 from scipy.optimize import newton
 
-from plot_sound_speed import get_sound_speed
+import plot_sound_speed
+from plot_sound_speed import get_sound_speed, integrate_sound_speed
+import tables
+import instrument
 
 SOUND_SPEED = 0.1
+# The spacing of the tabulated sound speed integral in solve_analytic_shadow
+DPHI = 2*np.pi / 10000
+# The number of find_peaks results kept in memory. 0 disables the cache.
+PEAKS_CACHE_SIZE = 0
+
+_peaks_cache:'OrderedDict[bytes,np.ndarray]' = OrderedDict()
 
 def find_peak(
     phi:np.ndarray,
@@ -27,12 +40,126 @@ def find_peak(
     return 0.5*(phi[i] + phi[i+1])
     
 
+class PeakTracker:
+    """
+    Find the peak of the spiral one row at a time, searching only the
+    cells inside the window around the predicted angle.
+    
+    The search domain is the same as in ``find_peak``: the cells with an
+    edge where ``|cos(phi) - cos(guess)| < width``. Those edges lie in
+    two arcs, at ``+/- arccos(cos(guess) -/+ width)``, so on a uniform
+    periodic grid they map directly to (wrapped) index windows, and the
+    domain test and argmax only run over those windows. The cost per row
+    is then proportional to the window width rather than to the grid
+    size. Other grids fall back to ``find_peak``.
+    
+    Parameters
+    ----------
+    phi : np.ndarray
+        The azimuthal coordinates (cell edges)
+    width : float
+        The width to search for the spiral in.
+    """
+    # extra cells searched on either side of an arc, to absorb rounding
+    MARGIN = 2
+    def __init__(self, phi:np.ndarray, width:float):
+        self.phi = phi
+        self.width = width
+        self.n_cells = len(phi) - 1
+        self.cos_phi = np.cos(phi)
+        _phi = np.asarray(phi, dtype=float)
+        self.phi0 = _phi[0]
+        self.dphi = (_phi[-1] - _phi[0]) / self.n_cells
+        # the edges only need to be within a fraction of a cell of the
+        # uniform grid, as the windows are padded by MARGIN cells
+        offsets = _phi - (self.phi0 + self.dphi*np.arange(len(_phi)))
+        self.uniform = bool(
+            np.isclose(_phi[-1] - _phi[0], 2*np.pi)
+            and np.max(np.abs(offsets)) < 0.5*self.dphi
+            and self.cos_phi[0] == self.cos_phi[-1]
+        )
+    
+    def _windows(self, lo:float, hi:float)->List[Tuple[int,int]]:
+        """
+        The cell ranges [start, stop) that cover the arc from lo to hi.
+        """
+        start = math.floor((lo - self.phi0) / self.dphi) - self.MARGIN - 1
+        stop = math.ceil((hi - self.phi0) / self.dphi) + self.MARGIN + 1
+        if stop - start >= self.n_cells:
+            return [(0, self.n_cells)]
+        length = stop - start
+        start %= self.n_cells
+        if start + length <= self.n_cells:
+            return [(start, start + length)]
+        return [(start, self.n_cells), (0, start + length - self.n_cells)]
+    
+    def find_peak(self, rho:np.ndarray, phi_previous:float, phi_previous_previous:float)->float:
+        """
+        Find the peak of the spiral at a single value of r
+        """
+        if not self.uniform:
+            return find_peak(self.phi, rho, phi_previous, phi_previous_previous, self.width)
+        guess = phi_previous + phi_previous - phi_previous_previous
+        cos_guess = np.cos(guess)
+        inner = math.acos(min(float(cos_guess) + self.width, 1.0))
+        outer = math.acos(max(float(cos_guess) - self.width, -1.0))
+        # merge the windows so each cell is searched once, in order
+        windows = []
+        for start, stop in sorted(self._windows(inner, outer) + self._windows(-outer, -inner)):
+            if windows and start <= windows[-1][1]:
+                windows[-1][1] = max(windows[-1][1], stop)
+            else:
+                windows.append([start, stop])
+        i_best = None
+        rho_best = None
+        # whether any cell in the windows is -inf rather than NaN
+        found = False
+        for start, stop in windows:
+            domain = np.abs(self.cos_phi[start:stop+1] - cos_guess) < self.width
+            domain = domain[1:] | domain[:-1]
+            values = np.where(domain, rho[start:stop], -np.inf)
+            i = np.argmax(values)
+            if np.isnan(values[i]):
+                values = np.where(domain, rho[start:stop], np.nan)
+                if np.isnan(values).all():
+                    continue
+                i = np.nanargmax(values)
+            # nanargmax also lands on a NaN when the rest is -inf
+            if not values[i] > -np.inf:
+                found = found or bool(domain.any())
+                continue
+            # strictly greater, so ties go to the first cell like nanargmax
+            if rho_best is None or values[i] > rho_best:
+                i_best = start + i
+                rho_best = values[i]
+        if i_best is None:
+            if not found:
+                raise ValueError('All-NaN slice encountered')
+            # nanargmax over a row that is -inf or NaN everywhere gives its first cell
+            i_best = 0
+        return 0.5*(self.phi[i_best] + self.phi[i_best+1])
+
+def configure_peaks_cache(size:int):
+    """
+    Set how many ``find_peaks`` results to keep in memory.
+    
+    Parameters
+    ----------
+    size : int
+        The number of results to keep. 0 disables the cache.
+    """
+    global PEAKS_CACHE_SIZE
+    PEAKS_CACHE_SIZE = size
+    while len(_peaks_cache) > max(size, 0):
+        _peaks_cache.popitem(last=False)
+
 def phi_planet(index:int):
     """
     The azimuthal angle of the planet.
     """ 
     return 0.5 * np.pi * (index % 4 - 1)
 
+@instrument.timed
 def find_peaks(
     r:np.ndarray,
     phi:np.ndarray,
@@ -61,10 +188,34 @@ def find_peaks(
     phi_peaks : np.ndarray
         The azimuthal angles of the spiral peaks
     """
+    if PEAKS_CACHE_SIZE <= 0:
+        return _find_peaks(r, phi, rho, phi_initial, width)
+    digest = hashlib.blake2b()
+    for value in (r, phi, rho, phi_initial, width):
+        value = np.ascontiguousarray(value)
+        digest.update(f'{value.dtype.str}:{value.shape}'.encode())
+        digest.update(value.tobytes())
+    key = digest.digest()
+    if key in _peaks_cache:
+        _peaks_cache.move_to_end(key)
+    else:
+        _peaks_cache[key] = _find_peaks(r, phi, rho, phi_initial, width)
+        while len(_peaks_cache) > PEAKS_CACHE_SIZE:
+            _peaks_cache.popitem(last=False)
+    return _peaks_cache[key].copy()
+
+def _find_peaks(
+    r:np.ndarray,
+    phi:np.ndarray,
+    rho:np.ndarray,
+    phi_initial:float,
+    width:float
+) -> np.ndarray:
+    tracker = PeakTracker(phi, width)
     # find i_r for the planet
     i_r = np.argmin(np.abs(r-1))
     # get a starting point
-    phi_at_planet = find_peak(phi,rho[i_r,:],phi_initial,phi_initial,width)
+    phi_at_planet = tracker.find_peak(rho[i_r,:],phi_initial,phi_initial)
     
     # go out from the planet
     indices = np.arange(i_r+1,len(r)-1,dtype=int)
@@ -72,7 +223,7 @@ def find_peaks(
     phi_last = phi_at_planet
     phi_last_last = phi_at_planet
     for i in indices:
-        _phi = find_peak(phi,rho[i,:],phi_last,phi_last_last,width)
+        _phi = tracker.find_peak(rho[i,:],phi_last,phi_last_last)
         phi_out.append(_phi)
         phi_last_last = phi_last
         phi_last = _phi
@@ -83,7 +234,7 @@ def find_peaks(
     phi_last = phi_at_planet
     phi_last_last = phi_at_planet
     for i in indices:
-        _phi = find_peak(phi,rho[i,:],phi_last,phi_last_last,width)
+        _phi = tracker.find_peak(rho[i,:],phi_last,phi_last_last)
         phi_in.append(_phi)
         phi_last_last = phi_last
         phi_last = _phi
@@ -94,6 +245,87 @@ def find_peaks(
     ])
     return phi_peaks
 
+def _find_peak_batch(
+    phi:np.ndarray,
+    cos_phi:np.ndarray,
+    rho:np.ndarray,
+    phi_previous:np.ndarray,
+    phi_previous_previous:np.ndarray,
+    width:float
+) -> np.ndarray:
+    """
+    Find the peak of the spiral at a single value of r in many snapshots.
+    
+    This is ``find_peak`` applied to each row of ``rho`` (nt, nphi).
+    """
+    guess = phi_previous + phi_previous - phi_previous_previous
+    domain = np.abs(cos_phi - np.cos(guess)[:,None]) < width
+    domain = domain[:,1:] | domain[:,:-1]
+    values = np.where(domain, rho, -np.inf)
+    # argmax would fall back to the first cell of a row with no cell in the window
+    if not np.all(np.any(domain, axis=1)):
+        raise ValueError('All-NaN slice encountered')
+    i = np.argmax(values, axis=1)
+    # only rows with NaNs need the slower NaN-aware search
+    has_nan = np.isnan(values[np.arange(len(i)), i])
+    if np.any(has_nan):
+        i[has_nan] = np.nanargmax(np.where(domain[has_nan], rho[has_nan], np.nan), axis=1)
+    return 0.5*(phi[i] + phi[i+1])
+
+@instrument.timed
+def find_peaks_batch(
+    r:np.ndarray,
+    phi:np.ndarray,
+    rho:np.ndarray,
+    phi_initial:float,
+    width:float
+) -> np.ndarray:
+    """
+    Find the peaks of the spirals in many snapshots at once.
+    
+    Each snapshot is tracked exactly as in ``find_peaks``, but all of
+    them advance together, one vectorized step per radius.
+    
+    Parameters
+    ----------
+    r : np.ndarray
+        The radial coordinates
+    phi : np.ndarray
+        The azimuthal coordinates
+    rho : np.ndarray
+        The density of each snapshot (nt, nrad, nphi)
+    phi_initial : float or np.ndarray
+        The azimuthal angle of the planet, in all snapshots or in each (nt,)
+    width : float
+        The width to search for the spiral in.
+    
+    Returns
+    -------
+    phi_peaks : np.ndarray
+        The azimuthal angles of the spiral peaks (nt, nrad)
+    """
+    cos_phi = np.cos(phi)
+    nt = rho.shape[0]
+    # find i_r for the planet
+    i_r = np.argmin(np.abs(r-1))
+    # get a starting point
+    start = np.broadcast_to(np.asarray(phi_initial, dtype=float), (nt,))
+    phi_at_planet = _find_peak_batch(phi,cos_phi,rho[:,i_r,:],start,start,width)
+    phi_peaks = np.empty((nt, len(r)-1), dtype=phi_at_planet.dtype)
+    phi_peaks[:,i_r] = phi_at_planet
+    
+    # go out from the planet, then in
+    for indices in (np.arange(i_r+1,len(r)-1,dtype=int), np.flip(np.arange(0,i_r,dtype=int))):
+        phi_last = phi_at_planet
+        phi_last_last = phi_at_planet
+        for i in indices:
+            _phi = _find_peak_batch(phi,cos_phi,rho[:,i,:],phi_last,phi_last_last,width)
+            phi_peaks[:,i] = _phi
+            phi_last_last = phi_last
+            phi_last = _phi
+    return phi_peaks
+
+@instrument.timed
 def central_difference(x,y,n:int)->Tuple[np.ndarray,np.ndarray]:
     """
     Take the derivative using central differences
@@ -108,6 +340,7 @@ def central_difference(x,y,n:int)->Tuple[np.ndarray,np.ndarray]:
 def zeta_analytic(_r):
     return np.arctan(1/np.abs((1 - _r**(-3/2))*_r/SOUND_SPEED))
 
+@instrument.timed
 def reconstruct(r,phi):
     """
     make things continuous
@@ -138,20 +371,11 @@ def reconstruct(r,phi):
             _phi = np.where(is_after,_phi - 2*np.pi,_phi)
         return r, _phi
     
-def eval_lhs(_phi_planet,phi_end, h, a, b, dphi= 2*np.pi / 10000):
+def eval_lhs(_phi_planet,phi_end, h, a, b):
     """
     Evaluate the LHS of the cot zeta equality
     """
-    n = int(np.abs(phi_end - _phi_planet)/ dphi)
-    _phi = np.linspace(_phi_planet, phi_end, n)
-    __phi = _phi % np.pi
-    assert np.all(__phi <= np.pi)
-    assert np.all(__phi >= -np.pi)
-    cs = SOUND_SPEED*get_sound_speed(__phi, h, a, b)
-    try:
-        return simpson(cs,_phi)
-    except ValueError:
-        return 0
+    return SOUND_SPEED*integrate_sound_speed(_phi_planet, phi_end, h, a, b)
 
 def eval_rhs(r):
     """
@@ -168,11 +392,108 @@ def get_best_phi(r,_phi_planet, h, a, b,guess = 1):
     except RuntimeError:
         return np.nan
 
+@instrument.timed
+def solve_analytic_shadow(
+    r:np.ndarray,
+    _phi_planet:float,
+    h:float,
+    a:float,
+    b:float,
+    dphi:float=DPHI
+)->Tuple[np.ndarray,np.ndarray]:
+    """
+    Solve the cot zeta equality for every radius at once.
+    
+    The sound speed is periodic in phi with period pi, so its cumulative
+    integral is tabulated over one period and whole periods are added
+    analytically. The LHS is then inverted for all radii by monotone
+    interpolation and refined with one Newton step. The pitch angle follows from differentiating the
+    equality, ``cs(phi) dphi = d(RHS)``, so no finite differences are needed.
+    
+    Parameters
+    ----------
+    r : np.ndarray
+        The radii
+    _phi_planet : float
+        The azimuthal angle of the planet
+    h : float
+        The sound speed reduction factor.
+    a : float
+        The half-width of the shadowed region.
+    b : float
+        The half-width of the unshadowed region.
+    dphi : float, optional
+        The spacing of the tabulated integral.
+    
+    Returns
+    -------
+    phi : np.ndarray
+        The azimuthal angle of the spiral at each radius
+    zeta : np.ndarray
+        The pitch angle of the spiral at each radius
+    """
+    r = np.asarray(r, dtype=float)
+    n = int(np.ceil(np.pi / dphi))
+    _phi = np.linspace(0, np.pi, n + 1)
+    lhs = eval_lhs(_phi_planet, _phi_planet + _phi, h, a, b)
+    per_period = lhs[-1]
+    rhs = eval_rhs(r)
+    turns = np.floor(rhs / per_period)
+    phi_best = _phi_planet + turns*np.pi + np.interp(rhs - turns*per_period, lhs, _phi)
+    # one Newton step on the exact integral removes the interpolation error
+    cs_best = SOUND_SPEED*get_sound_speed(phi_best % np.pi, h, a, b)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        step = (eval_lhs(_phi_planet, phi_best, h, a, b) - rhs) / cs_best
+    phi_best = np.where(cs_best > 0, phi_best - step, phi_best)
+    cs_best = SOUND_SPEED*get_sound_speed(phi_best % np.pi, h, a, b)
+    k = np.where(r < 1, 1, -1)
+    with np.errstate(divide='ignore'):
+        zeta = np.arctan(cs_best / np.abs(r - 1/np.sqrt(r)))
+    return phi_best * k, zeta
+
+@functools.lru_cache(maxsize=None)
+def get_solver_version()->str:
+    """
+    Hash the source of ``solve_analytic_shadow`` and everything it calls.
+    
+    The hash is part of the key of every cached solution, so editing the
+    solver recomputes them without anyone having to remember to.
+    """
+    digest = hashlib.sha256()
+    functions = (
+        solve_analytic_shadow, eval_lhs, eval_rhs,
+        plot_sound_speed.get_sound_speed, plot_sound_speed.integrate_sound_speed,
+        plot_sound_speed.antiderivative_sound_speed, plot_sound_speed._integrate_half_period,
+        plot_sound_speed._check_parameters
+    )
+    for func in functions:
+        digest.update(inspect.getsource(func).encode())
+    return digest.hexdigest()
+
+def _solve_analytic_shadow_cached(r:np.ndarray,_phi_planet:float,h:float,a:float,b:float)->Tuple[np.ndarray,np.ndarray]:
+    """
+    ``solve_analytic_shadow``, with the results kept in the table cache.
+    """
+    r = np.asarray(r, dtype=float)
+    def compute():
+        phi, zeta = solve_analytic_shadow(r,_phi_planet,h,a,b,DPHI)
+        return {'phi': phi, 'zeta': zeta}
+    params = {
+        'r': r, 'phi_planet': _phi_planet, 'h': h, 'a': a, 'b': b,
+        'sound_speed': SOUND_SPEED, 'dphi': DPHI, 'version': get_solver_version()
+    }
+    table = tables.get_table('analytic_shadow', params, compute)
+    return table['phi'], table['zeta']
+
+@instrument.timed
 def phi_peak_analytic_shadow(r:np.ndarray,_phi_planet:float,h:float,a:float,b:float)->np.ndarray:
-    return np.array([get_best_phi(_r,_phi_planet,h,a,b) for _r in r])
+    return _solve_analytic_shadow_cached(r,_phi_planet,h,a,b)[0]
     
+@instrument.timed
 def zeta_analytic_shadow(r:np.ndarray,_phi_planet:float,h:float,a:float,b:float,ndiff:int)->Tuple[np.ndarray,np.ndarray]:
-    _phi = phi_peak_analytic_shadow(r,_phi_planet,h,a,b)
-    logr, dphidr = central_difference(np.log(r),_phi,ndiff)
-    zeta = np.arctan(np.abs(1/dphidr))
-    return logr, zeta
\ No newline at end of file
+    """
+    The analytic pitch angle, at the points where a central difference
+    of order ``ndiff`` would be defined.
+    """
+    _, zeta = _solve_analytic_shadow_cached(r,_phi_planet,h,a,b)
+    return np.log(r)[ndiff:-ndiff], zeta[ndiff:-ndiff]
@@ -0,0 +1,110 @@
+"""
+Solve the analytic spiral shape over grids of shadow parameters.
+
+The parameters broadcast against each other like numpy arrays, so
+``sweep(r, h[:,None], a, b)`` pairs every ``h`` with each (a, b). Work is
+split into chunks of parameter sets, which are solved in a process pool.
+Finished sweeps are kept in the table cache.
+"""
+
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+import spirals
+import tables
+
+# The fields describing each parameter set, in order
+PARAMETERS = ('h', 'a', 'b', 'phi_planet')
+# The number of parameter sets solved by a worker at a time
+CHUNK_SIZE = 64
+
+def get_dtype(nrad:int)->np.dtype:
+    """
+    Get the dtype of the sweep results.
+
+    Parameters
+    ----------
+    nrad : int
+        The number of radii
+
+    Returns
+    -------
+    np.dtype
+        A structured dtype with one field per parameter, plus the
+        azimuthal angle ``phi`` and pitch angle ``zeta`` at each radius
+    """
+    return np.dtype(
+        [(name, float) for name in PARAMETERS]
+        + [('phi', float, (nrad,)), ('zeta', float, (nrad,))]
+    )
+
+def _solve_chunk(r:np.ndarray, params:np.ndarray)->np.ndarray:
+    """
+    Solve the spiral for each parameter set of a chunk.
+    """
+    out = np.empty(len(params), dtype=get_dtype(len(r)))
+    for name in PARAMETERS:
+        out[name] = params[name]
+    for i, (h, a, b, phi_planet) in enumerate(params):
+        out['phi'][i], out['zeta'][i] = spirals.solve_analytic_shadow(r, phi_planet, h, a, b, spirals.DPHI)
+    return out
+
+def sweep(
+    r:np.ndarray,
+    h:np.ndarray,
+    a:np.ndarray,
+    b:np.ndarray,
+    phi_planet:np.ndarray=0.,
+    jobs:int=None,
+    chunk_size:int=CHUNK_SIZE
+)->np.ndarray:
+    """
+    Solve the analytic spiral for every combination of parameters.
+
+    Parameters
+    ----------
+    r : np.ndarray
+        The radii
+    h : np.ndarray
+        The sound speed reduction factors
+    a : np.ndarray
+        The half-widths of the shadowed region
+    b : np.ndarray
+        The half-widths of the unshadowed region
+    phi_planet : np.ndarray, optional
+        The azimuthal angles of the planet
+    jobs : int, optional
+        The number of worker processes. Defaults to one per CPU. With a
+        single job or a single chunk, everything is solved in this process.
+    chunk_size : int, optional
+        The number of parameter sets sent to a worker at a time
+
+    Returns
+    -------
+    np.ndarray
+        A structured array with the broadcast shape of the parameters.
+        See ``get_dtype`` for its fields.
+    """
+    r = np.asarray(r, dtype=float)
+    grids = np.broadcast_arrays(*(np.asarray(x, dtype=float) for x in (h, a, b, phi_planet)))
+    shape = grids[0].shape
+    params = np.empty(grids[0].size, dtype=[(name, float) for name in PARAMETERS])
+    for name, grid in zip(PARAMETERS, grids):
+        params[name] = grid.ravel()
+    if params.size == 0:
+        return np.empty(shape, dtype=get_dtype(len(r)))
+    def compute():
+        chunks = [params[i:i+chunk_size] for i in range(0, len(params), chunk_size)]
+        if jobs == 1 or len(chunks) == 1:
+            results = [_solve_chunk(r, chunk) for chunk in chunks]
+        else:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                results = list(executor.map(_solve_chunk, repeat(r), chunks))
+        return {'sweep': np.concatenate(results)}
+    key = {
+        'r': r, 'params': params, 'sound_speed': spirals.SOUND_SPEED,
+        'dphi': spirals.DPHI, 'version': spirals.get_solver_version()
+    }
+    table = tables.get_table('sweep', key, compute)
+    return table['sweep'].reshape(shape)
@@ -0,0 +1,284 @@
+"""
+Write synthetic snapshots in the layout of the Athena++ outputs.
+
+Each case gets a directory of ``*.out1.NNNNN.athdf`` files and a
+``.tar.gz`` archive, named as ``read`` expects, at any resolution and
+length. The planet launches a wake whose shape follows the analytic
+spiral of ``spirals`` and whose amplitude grows over time. Shadowed
+cases get the azimuthal sound speed profile of ``get_sound_speed``, and
+their wakes bend with it. Set ``SHADOW_SPIRALS_DATA`` to the output
+directory to run the rest of the pipeline on the result.
+"""
+
+import os
+import shutil
+import tarfile
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Tuple
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import h5py
+
+import read
+import spirals
+from plot_sound_speed import H, get_sound_speed
+
+# A resolution comparable to the paper runs
+NRAD = 256
+NPHI = 512
+NSNAP = read.IMAX + 1
+# The radial extent of the grid
+R_MIN = 0.4
+R_MAX = 2.5
+
+# The (h, a, b) sound speed parameters of each shadow, as in the paper
+SHADOWS = {
+    'narrow': (H, 0.15, 1.32),
+    'wide': (H, 0.0, 0.0)
+}
+# The peak density perturbation of the wake, once grown
+AMPLITUDE = 0.2
+# The azimuthal width of the wake, in radians
+WIDTH = 0.1
+# The e-folding time of the wake amplitude, in snapshots
+GROWTH = 40
+
+def get_grid(nrad:int=NRAD, nphi:int=NPHI)->Tuple[np.ndarray,np.ndarray]:
+    """
+    Get the cell edges.
+
+    Parameters
+    ----------
+    nrad : int, optional
+        The number of radial cells
+    nphi : int, optional
+        The number of azimuthal cells
+
+    Returns
+    -------
+    r : np.ndarray
+        The radial cell edges, logarithmically spaced (nrad+1,)
+    phi : np.ndarray
+        The azimuthal cell edges (nphi+1,)
+    """
+    return np.geomspace(R_MIN, R_MAX, nrad + 1), np.linspace(-np.pi, np.pi, nphi + 1)
+
+def get_wake_phase(r:np.ndarray, _phi_planet:float, shadow:str)->np.ndarray:
+    """
+    Get the azimuthal angle of the planet's wake.
+
+    Without a shadow this is the integral of the cot zeta equality with
+    a constant sound speed, so the pitch angle is ``spirals.zeta_analytic``.
+    With a shadow the equality is solved by ``spirals.solve_analytic_shadow``.
+
+    Parameters
+    ----------
+    r : np.ndarray
+        The radii
+    _phi_planet : float
+        The azimuthal angle of the planet
+    shadow : str
+        'none', 'narrow', or 'wide'
+
+    Returns
+    -------
+    np.ndarray
+        The azimuthal angle of the wake at each radius
+    """
+    k = np.where(r < 1, 1, -1)
+    if shadow == 'none':
+        return _phi_planet + k*spirals.eval_rhs(r)/spirals.SOUND_SPEED
+    phi, _ = spirals.solve_analytic_shadow(r, _phi_planet, *SHADOWS[shadow])
+    # the solver returns the angle reached from the planet, signed by side
+    return _phi_planet + k*(k*phi - _phi_planet)
+
+def get_snapshot(
+    index:int,
+    shadow:str,
+    planet:bool,
+    r:np.ndarray,
+    phi:np.ndarray,
+    wakes:Dict[float,np.ndarray]=None
+)->np.ndarray:
+    """
+    Get the primitive variables of one snapshot.
+
+    Parameters
+    ----------
+    index : int
+        The snapshot index
+    shadow : str
+        'none', 'narrow', or 'wide'
+    planet : bool
+        True if the planet is present
+    r : np.ndarray
+        The radial cell edges
+    phi : np.ndarray
+        The azimuthal cell edges
+    wakes : dict, optional
+        Wake phases already computed for this grid, keyed by the angle of
+        the planet. New phases are added to it.
+
+    Returns
+    -------
+    np.ndarray
+        The primitive variables (5,1,1,nphi,nrad), as float32
+    """
+    r_mid = 0.5*(r[1:] + r[:-1])
+    phi_mid = 0.5*(phi[1:] + phi[:-1])
+    rho = np.broadcast_to(1/r_mid, (len(phi_mid), len(r_mid))).copy()
+    if planet:
+        wakes = {} if wakes is None else wakes
+        _phi_planet = spirals.phi_planet(index)
+        if _phi_planet not in wakes:
+            wakes[_phi_planet] = get_wake_phase(r_mid, _phi_planet, shadow)
+        offset = phi_mid[:, None] - wakes[_phi_planet][None, :]
+        offset = np.mod(offset + np.pi, 2*np.pi) - np.pi
+        amplitude = AMPLITUDE*(1 - np.exp(-index/GROWTH))
+        rho *= 1 + amplitude*np.exp(-0.5*(offset/WIDTH)**2)
+    if shadow == 'none':
+        temp = np.full(len(phi_mid), spirals.SOUND_SPEED**2)
+    else:
+        # the sound speed goes as the square root of the temperature
+        temp = (spirals.SOUND_SPEED * get_sound_speed(phi_mid, *SHADOWS[shadow]))**2
+    prim = np.zeros((5, 1, 1, len(phi_mid), len(r_mid)), dtype=np.float32)
+    prim[read.VARIABLES['rho'], 0, 0] = rho
+    prim[read.VARIABLES['press'], 0, 0] = rho*temp[:, None]
+    prim[read.VARIABLES['velphi'], 0, 0] = r_mid**-0.5
+    return prim
+
+def write_case(
+    shadow:str,
+    planet:bool,
+    nrad:int=NRAD,
+    nphi:int=NPHI,
+    nsnap:int=NSNAP,
+    extract:bool=True
+)->Path:
+    """
+    Write the snapshots and archive of one case into ``read.DATA_PATH``.
+
+    Both are written to temporary names and moved into place once
+    complete, replacing any previous data for the case.
+
+    Parameters
+    ----------
+    shadow : str
+        'none', 'narrow', or 'wide'
+    planet : bool
+        True if the planet is present
+    nrad : int, optional
+        The number of radial cells
+    nphi : int, optional
+        The number of azimuthal cells
+    nsnap : int, optional
+        The number of snapshots
+    extract : bool, optional
+        Also leave the snapshots extracted, as ``read.untar`` would.
+        Otherwise only the archive is kept.
+
+    Returns
+    -------
+    Path
+        The path to the archive
+    """
+    if nrad < 1 or nphi < 1 or nsnap < 1:
+        raise ValueError('The grid and the number of snapshots must be non-empty.')
+    case_path = read.get_case_path(shadow, planet)
+    tar_path = read.get_case_tar_path(shadow, planet)
+    case_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = Path(tempfile.mkdtemp(prefix=f'.{case_path.name}.', dir=case_path.parent))
+    tmp_tar_path = tar_path.with_name(f'{tmp_path.name}.tar.gz')
+    try:
+        r, phi = get_grid(nrad, nphi)
+        wakes = {}
+        with tarfile.open(tmp_tar_path, mode='w:gz') as tar:
+            for index in range(nsnap):
+                filename = read.get_filename(index, shadow, planet)
+                with h5py.File(tmp_path / filename, 'w') as f:
+                    f['prim'] = get_snapshot(index, shadow, planet, r, phi, wakes)
+                    f['x1f'] = r[None, :].astype(np.float32)
+                    f['x2f'] = phi[None, :].astype(np.float32)
+                tar.add(tmp_path / filename, arcname=filename)
+        # a cube packed from the old snapshots would be read instead
+        read.get_cube_path(shadow, planet).unlink(missing_ok=True)
+        shutil.rmtree(case_path, ignore_errors=True)
+        if extract:
+            (tmp_path / read.EXTRACTED_MARKER).touch()
+            os.rename(tmp_path, case_path)
+        os.replace(tmp_tar_path, tar_path)
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        tmp_tar_path.unlink(missing_ok=True)
+    return tar_path
+
+def _write_case(args:tuple)->Path:
+    """
+    Write a case by name, for use in a process pool.
+    """
+    case, data_path, nrad, nphi, nsnap, extract = args
+    read.DATA_PATH = data_path
+    return write_case(*read.CASES[case], nrad, nphi, nsnap, extract)
+
+def write(
+    cases:List[str]=None,
+    nrad:int=NRAD,
+    nphi:int=NPHI,
+    nsnap:int=NSNAP,
+    extract:bool=True,
+    jobs:int=None
+)->List[Path]:
+    """
+    Write several cases concurrently.
+
+    Parameters
+    ----------
+    cases : list of str, optional
+        The names of the cases to write. Defaults to all of them.
+    nrad : int, optional
+        The number of radial cells
+    nphi : int, optional
+        The number of azimuthal cells
+    nsnap : int, optional
+        The number of snapshots
+    extract : bool, optional
+        Also leave the snapshots extracted
+    jobs : int, optional
+        The number of worker processes. Defaults to one per case.
+
+    Returns
+    -------
+    list of Path
+        The paths to the archives
+    """
+    cases = list(read.CASES) if cases is None else list(cases)
+    for case in cases:
+        if case not in read.CASES:
+            raise ValueError(f'Unknown case: {case}')
+    args = [(case, read.DATA_PATH, nrad, nphi, nsnap, extract) for case in cases]
+    if jobs == 1 or len(cases) == 1:
+        return [_write_case(arg) for arg in args]
+    with ProcessPoolExecutor(max_workers=jobs or len(cases)) as executor:
+        return list(executor.map(_write_case, args))
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Write synthetic snapshots for offline runs.')
+    parser.add_argument('cases', nargs='*', help=f'The cases to write, out of {", ".join(read.CASES)}')
+    parser.add_argument('-o', '--output', type=Path, default=None, help='The data directory. Defaults to read.DATA_PATH.')
+    parser.add_argument('--nrad', type=int, default=NRAD, help='The number of radial cells')
+    parser.add_argument('--nphi', type=int, default=NPHI, help='The number of azimuthal cells')
+    parser.add_argument('--refine', type=int, default=1, help='Multiply both nrad and nphi by this factor')
+    parser.add_argument('--snapshots', type=int, default=NSNAP, help='The number of snapshots')
+    parser.add_argument('--archive-only', action='store_true', help='Keep only the archives, so they are extracted on first read')
+    parser.add_argument('--jobs', type=int, default=None, help='The number of worker processes')
+    args = parser.parse_args()
+    if args.output is not None:
+        read.DATA_PATH = args.output
+    paths_written = write(
+        args.cases or None, args.nrad*args.refine, args.nphi*args.refine,
+        args.snapshots, not args.archive_only, args.jobs
+    )
+    for path in paths_written:
+        print(f'Wrote {path}')
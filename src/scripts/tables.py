@@ -0,0 +1,142 @@
+"""
+A persistent cache of computed tables.
+
+Tables are dicts of arrays, stored as ``.npz`` files named by a hash
+of the inputs that produced them. Reading a table marks it as recently
+used, and the least recently used tables are deleted once the
+cache grows past its size limit.
+"""
+
+import os
+import hashlib
+from pathlib import Path
+from typing import Callable, Dict
+import numpy as np
+
+import paths
+
+# Where the tables are kept
+CACHE_DIR = paths.output / 'tables'
+# Upper bound on the disk space used by the cache, in bytes. 0 disables it.
+CACHE_NBYTES = 256 * 1024**2
+
+def configure_cache(directory:Path=None, nbytes:int=None):
+    """
+    Change where the tables are kept or how much space they may use.
+
+    Parameters
+    ----------
+    directory : Path, optional
+        The cache directory
+    nbytes : int, optional
+        The maximum number of bytes to keep on disk. 0 disables the cache.
+    """
+    global CACHE_DIR, CACHE_NBYTES
+    if directory is not None:
+        CACHE_DIR = Path(directory)
+    if nbytes is not None:
+        CACHE_NBYTES = nbytes
+    _evict()
+
+def clear_cache():
+    """
+    Delete every cached table.
+    """
+    for path in CACHE_DIR.glob('*.npz'):
+        path.unlink(missing_ok=True)
+
+def get_key(name:str, params:Dict[str,object])->str:
+    """
+    Hash the name of a table and the inputs it is computed from.
+
+    Parameters
+    ----------
+    name : str
+        The name of the table. Change it whenever the computation changes.
+    params : dict
+        The inputs, as arrays or scalars
+
+    Returns
+    -------
+    str
+        The key of the table
+    """
+    digest = hashlib.sha256(name.encode())
+    for param in sorted(params):
+        value = np.ascontiguousarray(params[param])
+        digest.update(f'{param}:{value.dtype.str}:{value.shape}'.encode())
+        digest.update(value.tobytes())
+    return digest.hexdigest()
+
+def _evict():
+    """
+    Delete the least recently used tables until the cache fits.
+    """
+    entries = []
+    for path in CACHE_DIR.glob('*.npz'):
+        try:
+            entries.append((path.stat(), path))
+        except FileNotFoundError:
+            continue
+    total = sum(stat.st_size for stat, _ in entries)
+    for stat, path in sorted(entries, key=lambda entry: entry[0].st_mtime_ns):
+        if total <= CACHE_NBYTES:
+            break
+        path.unlink(missing_ok=True)
+        total -= stat.st_size
+
+def _load(path:Path)->'Dict[str,np.ndarray] | None':
+    try:
+        with np.load(path, allow_pickle=False) as npz:
+            table = {name: npz[name] for name in npz.files}
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, EOFError):
+        # a damaged table is recomputed
+        path.unlink(missing_ok=True)
+        return None
+    os.utime(path)
+    return table
+
+def _save(path:Path, table:Dict[str,np.ndarray], compressed:bool):
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f'{path.stem}.{os.getpid()}.tmp')
+    with open(tmp_path, 'wb') as f:
+        (np.savez_compressed if compressed else np.savez)(f, **table)
+    os.replace(tmp_path, path)
+    _evict()
+
+def get_table(
+    name:str,
+    params:Dict[str,object],
+    compute:Callable[[],Dict[str,np.ndarray]],
+    compressed:bool=True
+)->Dict[str,np.ndarray]:
+    """
+    Get a table from the cache, computing and saving it if it is missing.
+
+    Parameters
+    ----------
+    name : str
+        The name of the table. Change it whenever the computation changes.
+    params : dict
+        The inputs the table is computed from, as arrays or scalars
+    compute : callable
+        Computes the table from scratch
+    compressed : bool, optional
+        Whether to compress the table on disk. Large tables of floats
+        hardly compress, and are faster to store as they are.
+
+    Returns
+    -------
+    dict
+        The arrays of the table
+    """
+    if CACHE_NBYTES <= 0:
+        return compute()
+    path = CACHE_DIR / f'{get_key(name, params)}.npz'
+    table = _load(path)
+    if table is None:
+        table = compute()
+        _save(path, table, compressed)
+    return table
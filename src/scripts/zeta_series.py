@@ -0,0 +1,366 @@
+"""
+Measure the pitch angle of the planet's spiral in every snapshot.
+
+Each snapshot is tracked as in the zeta figures: the planet-only run by
+its anomaly, and the shadowed runs by the residual against the matching
+run without the planet. The peaks are made continuous and differentiated
+to give zeta(r, t). Snapshots of a run are tracked together in batches
+by ``spirals.find_peaks_batch``, a few batches at a time in a pool, and
+the results are appended in blocks to a single HDF5 file, so an
+interrupted run resumes where it stopped.
+"""
+
+import os
+import time
+import warnings
+from pathlib import Path
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Tuple
+import numpy as np
+import h5py
+from tqdm import tqdm
+
+import paths
+import read
+import anomalies
+import spirals
+
+OUTFILE = paths.output / 'zeta_series.h5'
+# The tracked runs, by shadow
+SHADOWS = ['none', 'narrow', 'wide']
+WIDTH = 0.1
+NDIFF = 2
+# Snapshots in flight per worker
+PREFETCH = 2
+# Snapshots per HDF5 chunk, and per write
+CHUNK_ROWS = 64
+COMPRESSION = 'gzip'
+COMPRESSION_LEVEL = 4
+
+# Snapshots tracked together by spirals.find_peaks_batch
+BATCH_SIZE = 16
+
+# The anomaly buffer of this process, reused for every batch
+_buffer:np.ndarray = None
+
+def get_indices(shadow:str, start:int=read.IMIN, stop:int=read.IMAX+1)->np.ndarray:
+    """
+    Get the snapshots that can be measured, up to the first missing one.
+
+    Parameters
+    ----------
+    shadow : str
+        'none', 'narrow', or 'wide'
+    start : int, optional
+        The first snapshot index
+    stop : int, optional
+        One past the last snapshot index
+
+    Returns
+    -------
+    np.ndarray
+        The snapshot indices
+    """
+    planets = (True,) if shadow == 'none' else (True, False)
+    for index in range(start, stop):
+        if not all(read.has_snapshot(index, shadow, planet) for planet in planets):
+            return np.arange(start, index)
+    return np.arange(start, stop)
+
+def _get_zeta(lnr_mid:np.ndarray, phi_peak:np.ndarray, ndiff:int)->np.ndarray:
+    """
+    Get the pitch angle along a tracked spiral.
+    """
+    _lnr_mid, _phi_peak = spirals.reconstruct(lnr_mid, phi_peak)
+    _, dphidlnr = spirals.central_difference(_lnr_mid, _phi_peak, ndiff)
+    with np.errstate(divide='ignore'):
+        return np.arctan(np.abs(1/dphidlnr))
+
+def measure_batch(indices:List[int], shadow:str, width:float=WIDTH, ndiff:int=NDIFF)->Tuple[np.ndarray,np.ndarray]:
+    """
+    Measure the spiral in several snapshots of one run at once.
+
+    The snapshots are tracked together with ``spirals.find_peaks_batch``.
+    A snapshot whose spiral cannot be tracked is warned about and left
+    as NaN, rather than failing the others.
+
+    Parameters
+    ----------
+    indices : list of int
+        The snapshot indices
+    shadow : str
+        'none', 'narrow', or 'wide'
+    width : float, optional
+        The width to search for the spiral in
+    ndiff : int, optional
+        The order of the central difference
+
+    Returns
+    -------
+    phi_peak : np.ndarray
+        The azimuthal angle of the spiral at each radius (nt, nrad)
+    zeta : np.ndarray
+        The pitch angle at each radius with a central difference (nt, nrad-2*ndiff)
+    """
+    global _buffer
+    indices = [int(index) for index in indices]
+    r, phi = read.get_coords(indices[0], shadow, True)
+    lnr_mid = np.log(r[:-1] + np.diff(r)/2)
+    base = anomalies.get_baseline()
+    shape = (len(indices), *base.shape)
+    if _buffer is None or _buffer.shape[1:] != base.shape or len(_buffer) < len(indices):
+        _buffer = np.empty(shape, dtype=base.dtype)
+    data = _buffer[:len(indices)]
+    # writing into a buffer keeps the anomalies out of the cache
+    for k, index in enumerate(indices):
+        if shadow == 'none':
+            anomalies.anomaly(index, shadow, True, out=data[k])
+        else:
+            anomalies.residual(index, shadow, out=data[k])
+    rho = np.swapaxes(data, 1, 2)
+    planets = np.array([spirals.phi_planet(index) for index in indices])
+    try:
+        phi_peak = spirals.find_peaks_batch(r, phi, rho, planets, width)
+    except ValueError:
+        # track them one at a time to find the ones that fail
+        phi_peak = np.full((len(indices), len(lnr_mid)), np.nan)
+        for k, index in enumerate(indices):
+            try:
+                phi_peak[k] = spirals.find_peaks(r, phi, rho[k], planets[k], width)
+            except ValueError as err:
+                warnings.warn(f'Could not track snapshot {index} of {shadow}: {err}')
+    zeta = np.full((len(indices), len(lnr_mid) - 2*ndiff), np.nan)
+    for k in np.flatnonzero(~np.isnan(phi_peak).any(axis=1)):
+        zeta[k] = _get_zeta(lnr_mid, phi_peak[k], ndiff)
+    return phi_peak, zeta
+
+def measure(index:int, shadow:str, width:float=WIDTH, ndiff:int=NDIFF)->Tuple[np.ndarray,np.ndarray]:
+    """
+    Measure the spiral in one snapshot.
+
+    Parameters
+    ----------
+    index : int
+        The snapshot index
+    shadow : str
+        'none', 'narrow', or 'wide'
+    width : float, optional
+        The width to search for the spiral in
+    ndiff : int, optional
+        The order of the central difference
+
+    Returns
+    -------
+    phi_peak : np.ndarray
+        The azimuthal angle of the spiral at each radius (nrad,)
+    zeta : np.ndarray
+        The pitch angle at each radius with a central difference (nrad-2*ndiff,)
+    """
+    phi_peak, zeta = measure_batch([index], shadow, width, ndiff)
+    return phi_peak[0], zeta[0]
+
+def _measure_batch(task:Tuple[List[int],str,float,int])->Tuple[np.ndarray,np.ndarray]:
+    return measure_batch(*task)
+
+def iter_measurements(
+    batches:List[Tuple[List[int],str]],
+    width:float=WIDTH,
+    ndiff:int=NDIFF,
+    jobs:int=1
+)->Iterator[Tuple[np.ndarray,np.ndarray]]:
+    """
+    Measure many batches of snapshots, in order.
+
+    Only a few batches per worker are in flight at a time, however
+    many there are.
+
+    Parameters
+    ----------
+    batches : list of tuple
+        The (indices, shadow) of each batch
+    width : float, optional
+        The width to search for the spiral in
+    ndiff : int, optional
+        The order of the central difference
+    jobs : int, optional
+        The number of worker processes
+
+    Yields
+    ------
+    tuple
+        The (phi_peak, zeta) of each batch, as returned by ``measure_batch``
+    """
+    tasks = [(indices, shadow, width, ndiff) for indices, shadow in batches]
+    if jobs == 1:
+        yield from map(_measure_batch, tasks)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending = deque()
+        for task in tasks:
+            pending.append(executor.submit(_measure_batch, task))
+            if len(pending) >= PREFETCH*jobs:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def _get_group(f:h5py.File, shadow:str, indices:np.ndarray, nrad:int, log_r:np.ndarray, width:float, ndiff:int)->h5py.Group:
+    """
+    Get the group of one run, starting it afresh if it was made with
+    other snapshots or settings.
+    """
+    group = f.get(shadow)
+    if group is not None:
+        same = (
+            group.attrs.get('width') == width
+            and group.attrs.get('ndiff') == ndiff
+            and np.array_equal(group['index'][()], indices)
+            and group['phi_peak'].shape[1] == nrad
+        )
+        if same:
+            return group
+        del f[shadow]
+    group = f.create_group(shadow)
+    group.attrs['width'] = width
+    group.attrs['ndiff'] = ndiff
+    group['index'] = indices
+    group['log_r'] = log_r
+    group.create_dataset('done', shape=(len(indices),), dtype=bool, fillvalue=False)
+    for name, ncol in (('phi_peak', nrad), ('zeta', len(log_r))):
+        group.create_dataset(
+            name, shape=(len(indices), ncol), dtype=np.float32, fillvalue=np.nan,
+            chunks=(max(1, min(CHUNK_ROWS, len(indices))), ncol),
+            compression=COMPRESSION, compression_opts=COMPRESSION_LEVEL, shuffle=True
+        )
+    return group
+
+def _write_rows(group:h5py.Group, rows:List[Tuple[int,np.ndarray,np.ndarray]]):
+    """
+    Write a block of (position, phi_peak, zeta) rows and mark them done.
+    """
+    positions = [position for position, _, _ in rows]
+    group['phi_peak'][positions] = np.array([phi_peak for _, phi_peak, _ in rows], dtype=np.float32)
+    group['zeta'][positions] = np.array([zeta for _, _, zeta in rows], dtype=np.float32)
+    group['done'][positions] = True
+    group.file.flush()
+
+def run(
+    shadows:List[str]=SHADOWS,
+    start:int=read.IMIN,
+    stop:int=read.IMAX+1,
+    width:float=WIDTH,
+    ndiff:int=NDIFF,
+    jobs:int=1,
+    filename:Path=OUTFILE
+)->Path:
+    """
+    Measure every snapshot of several runs into one file.
+
+    Snapshots already measured with the same settings are skipped.
+    Snapshots whose spiral cannot be tracked are stored as NaN. A file
+    that is not HDF5 is moved aside to ``*.corrupt``, never deleted.
+
+    Parameters
+    ----------
+    shadows : list of str, optional
+        The runs to measure, by shadow
+    start : int, optional
+        The first snapshot index
+    stop : int, optional
+        One past the last snapshot index
+    width : float, optional
+        The width to search for the spiral in
+    ndiff : int, optional
+        The order of the central difference
+    jobs : int, optional
+        The number of worker processes
+    filename : Path, optional
+        The output file
+
+    Returns
+    -------
+    Path
+        The output file
+    """
+    for shadow in shadows:
+        if shadow not in SHADOWS:
+            raise ValueError(f'Unknown shadow: {shadow}')
+    filename = Path(filename)
+    filename.parent.mkdir(parents=True, exist_ok=True)
+    if filename.exists() and not h5py.is_hdf5(filename):
+        # keep whatever is there for inspection, and start a new file
+        corrupt_path = filename.with_name(f'{filename.name}.{time.strftime("%Y%m%dT%H%M%S")}.corrupt')
+        os.replace(filename, corrupt_path)
+        warnings.warn(f'{filename} is not an HDF5 file, moved it to {corrupt_path}')
+    # locking and permission errors propagate, leaving the file alone
+    with h5py.File(filename, 'a') as f:
+        groups:Dict[str,h5py.Group] = {}
+        # (shadow, indices, positions) of each batch of snapshots to measure
+        batches = []
+        for shadow in shadows:
+            indices = get_indices(shadow, start, stop)
+            if len(indices) == 0:
+                continue
+            r, _ = read.get_coords(int(indices[0]), shadow, True)
+            lnr_mid = np.log(r[:-1] + np.diff(r)/2)
+            # the radii at which central_difference is defined
+            log_r = lnr_mid[ndiff:-ndiff]
+            group = _get_group(f, shadow, indices, len(r) - 1, log_r, width, ndiff)
+            groups[shadow] = group
+            positions = np.flatnonzero(~group['done'][()])
+            for k in range(0, len(positions), BATCH_SIZE):
+                batch = positions[k:k+BATCH_SIZE]
+                batches.append((shadow, [int(index) for index in indices[batch]], batch))
+        blocks:Dict[str,list] = {shadow: [] for shadow in groups}
+        results = iter_measurements([(batch_indices, shadow) for shadow, batch_indices, _ in batches], width, ndiff, jobs)
+        progress = tqdm(total=sum(len(positions) for _, _, positions in batches))
+        for (shadow, _, positions), (phi_peaks, zetas) in zip(batches, results):
+            blocks[shadow] += zip(positions, phi_peaks, zetas)
+            progress.update(len(positions))
+            if len(blocks[shadow]) >= CHUNK_ROWS:
+                _write_rows(groups[shadow], blocks[shadow])
+                blocks[shadow] = []
+        progress.close()
+        for shadow, rows in blocks.items():
+            if rows:
+                _write_rows(groups[shadow], rows)
+    return filename
+
+def load(shadow:str, filename:Path=OUTFILE)->Dict[str,np.ndarray]:
+    """
+    Load the measurements of one run.
+
+    Parameters
+    ----------
+    shadow : str
+        'none', 'narrow', or 'wide'
+    filename : Path, optional
+        The file written by ``run``
+
+    Returns
+    -------
+    dict
+        The snapshot 'index' (nt,), the 'phi_peak' (nt, nrad), and the
+        'zeta' (nt, nrad-2*ndiff) at each 'log_r'. Snapshots not yet
+        measured are NaN.
+    """
+    with h5py.File(filename, 'r') as f:
+        group = f[shadow]
+        return {name: group[name][()] for name in ('index', 'log_r', 'phi_peak', 'zeta')}
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Measure the spiral pitch angle in every snapshot.')
+    parser.add_argument('shadows', nargs='*', help=f'The runs to measure, out of {", ".join(SHADOWS)}')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='The number of worker processes')
+    parser.add_argument('-o', '--output', type=Path, default=OUTFILE, help='The HDF5 file to write')
+    parser.add_argument('--start', type=int, default=read.IMIN, help='The first snapshot index')
+    parser.add_argument('--stop', type=int, default=read.IMAX+1, help='One past the last snapshot index')
+    parser.add_argument('--width', type=float, default=WIDTH, help='The width to search for the spiral in')
+    parser.add_argument('--ndiff', type=int, default=NDIFF, help='The order of the central difference')
+    args = parser.parse_args()
+    unknown = sorted(set(args.shadows) - set(SHADOWS))
+    if unknown:
+        parser.error(f'Unknown shadows: {", ".join(unknown)}')
+    filename = run(args.shadows or SHADOWS, args.start, args.stop, args.width, args.ndiff, args.jobs, args.output)
+    print(f'Wrote {filename}')
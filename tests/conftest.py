@@ -0,0 +1,58 @@
+"""
+Shared fixtures: small synthetic cases in a temporary data directory.
+"""
+
+import sys
+from pathlib import Path
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'src' / 'scripts'))
+
+import read
+import tables
+import archive
+import anomalies
+import synthetic
+
+NRAD = 16
+NPHI = 32
+NSNAP = 4
+
+@pytest.fixture(scope='session', autouse=True)
+def tables_dir(tmp_path_factory):
+    """
+    Keep the tables computed by the tests out of the repository.
+    """
+    previous = tables.CACHE_DIR
+    tables.CACHE_DIR = tmp_path_factory.mktemp('tables')
+    yield tables.CACHE_DIR
+    tables.CACHE_DIR = previous
+
+@pytest.fixture(scope='session')
+def data_path(tmp_path_factory):
+    """
+    Write every case once, with its snapshots left extracted.
+    """
+    path = tmp_path_factory.mktemp('data')
+    previous = read.DATA_PATH
+    read.DATA_PATH = path
+    for shadow, planet in read.CASES.values():
+        synthetic.write_case(shadow, planet, NRAD, NPHI, NSNAP)
+    read.DATA_PATH = previous
+    return path
+
+@pytest.fixture
+def data(data_path, monkeypatch):
+    """
+    Point ``read`` at the synthetic cases, with empty in-process caches.
+    """
+    monkeypatch.setattr(read, 'DATA_PATH', data_path)
+    read.close_all()
+    read._cubes.clear()
+    archive._indices.clear()
+    anomalies.clear_cache()
+    yield data_path
+    read.close_all()
+    read._cubes.clear()
+    for shadow, planet in read.CASES.values():
+        read.get_cube_path(shadow, planet).unlink(missing_ok=True)
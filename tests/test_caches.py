@@ -0,0 +1,97 @@
+import numpy as np
+
+import read
+import tables
+import spirals
+import anomalies
+import synthetic
+
+def test_anomaly_is_cached(data, monkeypatch):
+    calls = []
+    get_data = read.get_data
+    def counted(*args, **kwargs):
+        calls.append(args)
+        return get_data(*args, **kwargs)
+    monkeypatch.setattr(read, 'get_data', counted)
+    first = anomalies.anomaly(2, 'narrow', True)
+    assert len(calls) == 2
+    assert anomalies.anomaly(2, 'narrow', True) is first
+    assert len(calls) == 2
+    assert not first.flags.writeable
+    # the baseline is shared with other snapshots
+    anomalies.anomaly(3, 'narrow', True)
+    assert len(calls) == 3
+    out = np.empty_like(first)
+    assert anomalies.anomaly(2, 'narrow', True, out=out) is out
+    np.testing.assert_array_equal(out, first)
+    anomalies.clear_cache()
+    np.testing.assert_array_equal(anomalies.anomaly(2, 'narrow', True), first)
+    assert len(calls) == 5
+
+def test_anomaly_into_buffer_is_not_cached(data):
+    out = np.empty_like(anomalies.get_baseline())
+    anomalies.anomaly(1, 'wide', False, out=out)
+    assert anomalies._lookup(('anomaly', 1, read.get_case_name('wide', False), 'rho', anomalies.BASELINE)) is None
+    np.testing.assert_array_equal(anomalies.anomaly(1, 'wide', False), out)
+
+def test_anomaly_cache_evicts(data, monkeypatch):
+    monkeypatch.setattr(anomalies, 'CACHE_NBYTES', anomalies.get_baseline().nbytes * 2)
+    for index in range(4):
+        anomalies.anomaly(index, 'narrow', True)
+    assert anomalies._cache_nbytes <= anomalies.CACHE_NBYTES
+    assert len(anomalies._cache) == 2
+
+def test_table_keys():
+    params = {'r': np.linspace(0, 1, 5), 'h': 0.05}
+    key = tables.get_key('table', params)
+    assert tables.get_key('table', dict(reversed(params.items()))) == key
+    assert tables.get_key('other', params) != key
+    assert tables.get_key('table', {**params, 'h': 0.06}) != key
+    assert tables.get_key('table', {**params, 'r': np.linspace(0, 1, 6)}) != key
+    assert tables.get_key('table', {**params, 'r': params['r'].astype(np.float32)}) != key
+    # the same bytes in another shape
+    assert tables.get_key('table', {**params, 'r': np.zeros((2, 2))}) != tables.get_key('table', {**params, 'r': np.zeros(4)})
+
+def test_table_is_computed_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(tables, 'CACHE_DIR', tmp_path)
+    calls = []
+    def compute():
+        calls.append(1)
+        return {'x': np.arange(10.0)}
+    for _ in range(2):
+        np.testing.assert_array_equal(tables.get_table('table', {'n': 10}, compute)['x'], np.arange(10.0))
+    assert len(calls) == 1
+    tables.get_table('table', {'n': 11}, compute)
+    assert len(calls) == 2
+    assert len(list(tmp_path.glob('*.npz'))) == 2
+    tables.clear_cache()
+    tables.get_table('table', {'n': 10}, compute)
+    assert len(calls) == 3
+
+def test_damaged_table_is_recomputed(tmp_path, monkeypatch):
+    monkeypatch.setattr(tables, 'CACHE_DIR', tmp_path)
+    def compute():
+        return {'x': np.arange(3)}
+    tables.get_table('table', {}, compute)
+    path, = tmp_path.glob('*.npz')
+    path.write_bytes(b'not a table')
+    np.testing.assert_array_equal(tables.get_table('table', {}, compute)['x'], np.arange(3))
+
+def test_analytic_shadow_keyed_by_solver_version(tmp_path, monkeypatch):
+    monkeypatch.setattr(tables, 'CACHE_DIR', tmp_path)
+    calls = []
+    solve = spirals.solve_analytic_shadow
+    def counted(*args, **kwargs):
+        calls.append(args)
+        return solve(*args, **kwargs)
+    monkeypatch.setattr(spirals, 'solve_analytic_shadow', counted)
+    r = np.geomspace(1, 2, 8)
+    h, a, b = synthetic.SHADOWS['narrow']
+    expected = spirals.phi_peak_analytic_shadow(r, 0.0, h, a, b)
+    np.testing.assert_array_equal(spirals.phi_peak_analytic_shadow(r, 0.0, h, a, b), expected)
+    assert len(calls) == 1
+    spirals.phi_peak_analytic_shadow(r, 0.0, h, 0.2, b)
+    assert len(calls) == 2
+    monkeypatch.setattr(spirals, 'get_solver_version', lambda: 'edited')
+    np.testing.assert_array_equal(spirals.phi_peak_analytic_shadow(r, 0.0, h, a, b), expected)
+    assert len(calls) == 3
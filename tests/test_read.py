@@ -0,0 +1,71 @@
+import io
+import os
+import zlib
+import tarfile
+import numpy as np
+import pytest
+
+import read
+import archive
+import synthetic
+from conftest import NSNAP
+
+def _write_flushed_archive(tar_path, case_path, names, span):
+    """
+    Archive the files again, with a byte-aligned deflate block boundary
+    every ``span`` bytes so the index is sure to save access points.
+    """
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w') as tar:
+        for name in names:
+            tar.add(case_path / name, arcname=name)
+    data = buffer.getvalue()
+    compressor = zlib.compressobj(wbits=archive.WBITS)
+    with open(tar_path, 'wb') as f:
+        for offset in range(0, len(data), span):
+            f.write(compressor.compress(data[offset:offset+span]))
+            f.write(compressor.flush(zlib.Z_FULL_FLUSH))
+        f.write(compressor.flush())
+
+def test_archive_members_match_extracted_files(monkeypatch, tmp_path):
+    monkeypatch.setattr(read, 'DATA_PATH', tmp_path)
+    monkeypatch.setattr(archive, 'SPAN', 4096)
+    monkeypatch.setattr(archive, '_indices', {})
+    tar_path = synthetic.write_case('narrow', True, nrad=64, nphi=256, nsnap=NSNAP)
+    case_path = read.get_case_path('narrow', True)
+    names = [read.get_filename(index, 'narrow', True) for index in range(NSNAP)]
+    _write_flushed_archive(tar_path, case_path, names, archive.SPAN)
+    for name in names:
+        assert archive.read_member(tar_path, name) == (case_path / name).read_bytes()
+    # a new process only has the saved index to go on
+    archive._indices.clear()
+    index = archive.get_index(tar_path)
+    assert index.seekable and len(index._points) > 1
+    for name in reversed(names):
+        assert index.read_member(name) == (case_path / name).read_bytes()
+
+def test_stop_defaults_to_first_missing_snapshot(data):
+    assert read.get_stop('narrow', True) == NSNAP
+    assert len(read.Series('narrow', True, 'rho')) == NSNAP
+
+def test_cube_series_matches_snapshots(data):
+    expected = np.stack([read.get_data(index, 'narrow', True, 'rho') for index in range(NSNAP)])
+    read.pack('narrow', True)
+    assert read.open_cube('narrow', True) is not None
+    series = read.Series('narrow', True, 'rho')
+    np.testing.assert_array_equal(series[:], np.swapaxes(expected, 1, 2))
+    np.testing.assert_array_equal(series[::-2, 3, 1:5], np.swapaxes(expected, 1, 2)[::-2, 3, 1:5])
+    data = read.get_data(1, 'narrow', True, 'rho')
+    np.testing.assert_array_equal(data, expected[1])
+    assert data.flags.writeable
+
+def test_cube_repacked_when_archive_changes(data):
+    read.pack('narrow', True, stop=NSNAP - 1)
+    assert read.open_cube('narrow', True).stop == NSNAP - 1
+    tar_path = read.get_case_tar_path('narrow', True)
+    stat = tar_path.stat()
+    os.utime(tar_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    with pytest.warns(UserWarning, match='packing it again'):
+        cube = read.open_cube('narrow', True)
+    assert cube.stop == NSNAP
+    assert cube.source == [stat.st_size, stat.st_mtime_ns + 10**9]
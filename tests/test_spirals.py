@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+import read
+import spirals
+from conftest import NSNAP
+
+def _peak_or_error(find, *args):
+    try:
+        return find(*args)
+    except ValueError:
+        return 'error'
+
+@pytest.mark.parametrize('width', [0.05, 0.3, 1.5])
+def test_tracker_matches_find_peak(width):
+    rng = np.random.default_rng(2)
+    phi = np.linspace(-np.pi, np.pi, 129)
+    rho = rng.random((500, 128))
+    rho[rho < 0.3] = -np.inf
+    rho[rho > 0.97] = np.nan
+    # rows that are -inf, NaN or a mix of the two everywhere
+    rho[::7] = -np.inf
+    rho[5::13] = np.where(rng.random(128) < 0.5, np.nan, -np.inf)
+    rho[9::17] = np.nan
+    phi_previous = rng.uniform(-3, 3, len(rho))
+    phi_previous_previous = phi_previous + rng.uniform(-0.1, 0.1, len(rho))
+    tracker = spirals.PeakTracker(phi, width)
+    assert tracker.uniform
+    for row, previous, previous_previous in zip(rho, phi_previous, phi_previous_previous):
+        expected = _peak_or_error(spirals.find_peak, phi, row, previous, previous_previous, width)
+        assert _peak_or_error(tracker.find_peak, row, previous, previous_previous) == expected
+
+def test_batch_matches_find_peaks(data):
+    r, phi = read.get_coords(0, 'narrow', True)
+    rho = np.stack([read.get_data(index, 'narrow', True, 'rho').T for index in range(NSNAP)])
+    phi_planets = np.array([spirals.phi_planet(index) for index in range(NSNAP)])
+    expected = np.stack([
+        spirals.find_peaks(r, phi, rho[k], phi_planets[k], 0.2) for k in range(NSNAP)
+    ])
+    np.testing.assert_array_equal(spirals.find_peaks_batch(r, phi, rho, phi_planets, 0.2), expected)
+
+def test_batch_raises_on_empty_window():
+    phi = np.linspace(-np.pi, np.pi, 33)
+    r = np.geomspace(0.5, 2, 9)
+    rho = np.full((2, 8, 32), np.nan)
+    with pytest.raises(ValueError):
+        spirals.find_peaks_batch(r, phi, rho, 0.0, 0.2)